@@ -0,0 +1,282 @@
+########################################################################
+#
+# Vectorized data-augmentation for batches of images, e.g. from
+# cifar10.batches() or cifar10.load_training_data().
+#
+# Usage:
+# 1) Call augment() with a 4-dim array of images with the shape:
+#    [image_number, height, width, channel]
+# 2) Use the returned images for training instead of the originals.
+#
+# The images can either be uint8 with pixels between 0 and 255, or
+# floats with pixels between 0.0 and 1.0. Each transformation works on
+# the whole block of images at once using numpy broadcasting and fancy
+# indexing, instead of looping over the images in Python. Large blocks
+# are split into chunks that are processed in parallel by a thread-pool.
+#
+# The random numbers are drawn from a separate generator for each chunk
+# which is seeded from the given seed, so the results can be reproduced
+# regardless of the number of threads.
+#
+########################################################################
+
+import numpy as np
+import os
+import concurrent.futures
+
+########################################################################
+
+# Number of images processed by each thread at a time.
+# This is fixed so the results do not depend on the number of threads.
+_chunk_size = 256
+
+# Weights for converting RGB-pixels to gray-scale.
+_gray_weights = np.array([0.299, 0.587, 0.114], dtype=np.float32)
+
+########################################################################
+
+
+def random_crop(images, rng, padding=4, out=None):
+    """
+    Pad the images with zeros and crop them at random positions
+    back to their original size.
+
+    :param images:
+        Array with shape [image_number, height, width, channel].
+
+    :param rng:
+        np.random.RandomState used for the random positions.
+
+    :param padding:
+        Number of pixels to pad on each side of the images.
+
+    :param out:
+        Optional array for the output with the same shape and dtype.
+
+    :return:
+        Array with the cropped images.
+    """
+
+    num_images, height, width, _ = images.shape
+
+    # Pad all the images at once.
+    padded = np.pad(images, [(0, 0), (padding, padding), (padding, padding), (0, 0)],
+                    mode='constant')
+
+    # Random offset for the crop of each image.
+    offset_y = rng.randint(0, 2 * padding + 1, size=num_images)
+    offset_x = rng.randint(0, 2 * padding + 1, size=num_images)
+
+    # Indices for the rows and columns of each crop.
+    rows = offset_y[:, np.newaxis] + np.arange(height)
+    cols = offset_x[:, np.newaxis] + np.arange(width)
+    idx = np.arange(num_images)
+
+    # Gather the crops for all images using broadcast fancy-indexing.
+    cropped = padded[idx[:, np.newaxis, np.newaxis],
+                     rows[:, :, np.newaxis],
+                     cols[:, np.newaxis, :]]
+
+    if out is None:
+        return cropped
+
+    out[...] = cropped
+
+    return out
+
+
+def random_flip(images, rng, out=None):
+    """
+    Flip half of the images horizontally, chosen at random.
+
+    :param images:
+        Array with shape [image_number, height, width, channel].
+
+    :param rng:
+        np.random.RandomState used for choosing the images.
+
+    :param out:
+        Optional array for the output with the same shape and dtype.
+        This can be the images-array itself to flip in-place.
+
+    :return:
+        Array with the flipped images.
+    """
+
+    flip = rng.rand(len(images)) < 0.5
+
+    if out is None:
+        out = images.copy()
+    elif out is not images:
+        out[...] = images
+
+    out[flip] = images[flip, :, ::-1]
+
+    return out
+
+
+def color_jitter(images, rng, brightness=0.2, contrast=0.2, saturation=0.2):
+    """
+    Randomly change the brightness, contrast and saturation of each image.
+
+    The factor for each change is drawn uniformly from [1-x, 1+x] for each
+    image, where x is the given amount. Use 0 to skip a change.
+
+    :param images:
+        Array of floats with shape [image_number, height, width, channel]
+        and pixels between 0.0 and 1.0. It is modified in-place.
+        The saturation is only changed for RGB-images with 3 channels.
+
+    :param rng:
+        np.random.RandomState used for the random factors.
+
+    :return:
+        The images-array.
+    """
+
+    num_images = len(images)
+
+    # Shape for broadcasting a factor for each image.
+    shape = (num_images, 1, 1, 1)
+
+    def factors(amount):
+        return rng.uniform(1.0 - amount, 1.0 + amount, size=shape).astype(images.dtype)
+
+    if brightness > 0:
+        images *= factors(brightness)
+
+    if contrast > 0:
+        # Scale the pixels around the mean of each image.
+        mean = images.mean(axis=(1, 2, 3), keepdims=True)
+        images -= mean
+        images *= factors(contrast)
+        images += mean
+
+    if saturation > 0 and images.shape[-1] == 3:
+        # Scale the pixels around the gray-scale value of each pixel.
+        gray = np.dot(images, _gray_weights.astype(images.dtype))[..., np.newaxis]
+        images -= gray
+        images *= factors(saturation)
+        images += gray
+
+    np.clip(images, 0.0, 1.0, out=images)
+
+    return images
+
+
+def _augment_chunk(images, out, seed, crop_padding, flip,
+                   brightness, contrast, saturation):
+    """
+    Augment a chunk of images and write the result to out.
+    """
+
+    rng = np.random.RandomState(seed)
+
+    if crop_padding > 0:
+        result = random_crop(images, rng=rng, padding=crop_padding)
+    else:
+        result = images.copy()
+
+    if flip:
+        result = random_flip(result, rng=rng, out=result)
+
+    if brightness > 0 or contrast > 0 or saturation > 0:
+        if result.dtype == np.uint8:
+            # Convert to floats between 0.0 and 1.0 for the jitter.
+            result = result.astype(np.float32) / 255.0
+            color_jitter(result, rng=rng, brightness=brightness,
+                         contrast=contrast, saturation=saturation)
+            np.multiply(result, 255.0, out=result)
+            np.rint(result, out=result)
+        else:
+            color_jitter(result, rng=rng, brightness=brightness,
+                         contrast=contrast, saturation=saturation)
+
+    out[...] = result
+
+
+def augment(images, seed=None, crop_padding=4, flip=True,
+            brightness=0.2, contrast=0.2, saturation=0.2,
+            out=None, num_workers=None):
+    """
+    Apply random crops, horizontal flips and colour-jitter to a block
+    of images. The input images are not modified.
+
+    Example:
+
+        for images, cls in cifar10.batches(batch_size=64, seed=42):
+            images = augment(images, seed=step)
+            ...
+
+    :param images:
+        Array with shape [image_number, height, width, channel].
+        Either uint8 with pixels between 0 and 255, or floats
+        with pixels between 0.0 and 1.0.
+
+    :param seed:
+        Seed for the random numbers. Use e.g. the training-step
+        to get different but reproducible augmentations for each batch.
+
+    :param crop_padding:
+        Number of pixels for the random crops, see random_crop().
+        Use 0 to skip the random crops.
+
+    :param flip:
+        Boolean whether to randomly flip the images horizontally.
+
+    :param brightness:
+        Amount of random change to the brightness, see color_jitter().
+
+    :param contrast:
+        Amount of random change to the contrast, see color_jitter().
+
+    :param saturation:
+        Amount of random change to the saturation, see color_jitter().
+        This is ignored unless the images are RGB with 3 channels.
+
+    :param out:
+        Optional array for the output with the same shape and dtype
+        as the images, e.g. to reuse the same buffer for every batch.
+
+    :param num_workers:
+        Number of threads. If None then use the number of CPU cores.
+
+    :return:
+        Array with the augmented images.
+    """
+
+    if out is None:
+        out = np.empty_like(images)
+
+    num_images = len(images)
+
+    # Begin-index for each chunk of images.
+    begins = list(range(0, num_images, _chunk_size))
+
+    # Seed for each chunk, drawn from the given seed.
+    seeds = np.random.RandomState(seed).randint(0, 2 ** 31 - 1, size=len(begins))
+
+    def process(i):
+        begin = begins[i]
+        end = begin + _chunk_size
+
+        _augment_chunk(images[begin:end], out=out[begin:end], seed=seeds[i],
+                       crop_padding=crop_padding, flip=flip,
+                       brightness=brightness, contrast=contrast,
+                       saturation=saturation)
+
+    if num_workers is None:
+        num_workers = os.cpu_count() or 1
+
+    if num_workers <= 1 or len(begins) <= 1:
+        for i in range(len(begins)):
+            process(i)
+    else:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=num_workers) as executor:
+            # Use list() to raise any exceptions from the threads.
+            list(executor.map(process, range(len(begins))))
+
+    return out
+
+
+########################################################################
@@ -1,8 +1,16 @@
+import os
+import concurrent.futures
 import numpy as np
 import bokeh.plotting as bk
 
-def test_func(x, err=0.5):
-    return np.random.normal(10 - 1. / (x + 0.1), err)
+def true_func(x):
+    return 10 - 1. / (x + 0.1)
+
+def test_func(x, err=0.5, rng=None):
+    # rng is an optional np.random.RandomState, otherwise the global one is used
+    if rng is None:
+        rng = np.random
+    return rng.normal(true_func(x), err)
 
 def compute_error(x, y, p):
     yfit = np.polyval(p, x)
@@ -40,3 +48,131 @@ def plot_bias_variance(N=8, random_seed=42, err=0.5):
     gp = bk.gridplot([row], border_space=0)
     bk.show(gp)
 
+
+def _simulate_chunk(seed, num_draws, x, x_eval, degrees, err):
+    # Fit all the degrees to num_draws noisy samples of true_func(x) and
+    # return (count, mean, m2, error) where mean and m2 are the mean and
+    # the sum of squared deviations of the predictions at x_eval for each
+    # degree and draw, and error is the summed squared test-error for each
+    # degree, and the summed squared noise of the test-samples.
+    rng = np.random.RandomState(seed)
+    max_degree = max(degrees)
+
+    # New training-samples for each draw, as columns, and an independent
+    # test-sample at x_eval for measuring the expected test-error.
+    Y = test_func(np.broadcast_to(x[:, np.newaxis], (len(x), num_draws)), err, rng=rng)
+    Y_test = test_func(np.broadcast_to(x_eval[:, np.newaxis], (len(x_eval), num_draws)),
+                       err, rng=rng)
+    f_eval = true_func(x_eval)[:, np.newaxis]
+
+    # The QR-decomposition of the Vandermonde matrix for the highest degree
+    # also gives the decomposition for all the lower degrees, from its
+    # leading columns. So all the draws are projected in one matrix-product,
+    # and each degree only needs a small triangular solve.
+    V = np.vander(x, max_degree + 1, increasing=True)
+    V_eval = np.vander(x_eval, max_degree + 1, increasing=True)
+    Q, R = np.linalg.qr(V)
+    QtY = np.dot(Q.T, Y)
+
+    mean = np.empty((len(degrees), len(x_eval)))
+    m2 = np.empty((len(degrees), len(x_eval)))
+    error = np.empty(len(degrees))
+    for i, d in enumerate(degrees):
+        coef = np.linalg.solve(R[:d + 1, :d + 1], QtY[:d + 1])
+        yfit = np.dot(V_eval[:, :d + 1], coef)
+        mean[i] = yfit.mean(axis=1)
+        m2[i] = ((yfit - mean[i][:, np.newaxis]) ** 2).sum(axis=1)
+        error[i] = ((Y_test - yfit) ** 2).sum()
+    noise = ((Y_test - f_eval) ** 2).sum()
+
+    return num_draws, mean, m2, error, noise
+
+def bias_variance_decomposition(degrees=None, N=8, num_draws=10000, err=0.5,
+                                x=None, x_eval=None, random_seed=42,
+                                chunk_size=1000, num_workers=None):
+    """
+    Monte Carlo estimate of the bias-variance decomposition for polynomial
+    fits of the given degrees to N noisy samples of true_func.
+
+    New samples are drawn from test_func num_draws times, all the degrees
+    are fitted to each of them, and the predictions at x_eval are compared
+    to true_func and to new noisy test-samples. The draws are split into
+    chunks of chunk_size that run on a pool of num_workers processes.
+    Each chunk has its own random seed drawn from random_seed, so the
+    results are the same for any number of workers.
+
+    Returns a dict with arrays for each degree:
+    'bias2' is the squared bias, 'variance' is the variance of the
+    predictions, 'noise' is the irreducible error, and 'error' is the
+    expected squared test-error which is about bias2 + variance + noise.
+    """
+    if x is None:
+        x = 10 ** np.linspace(-2, 0, N)
+    x = np.asarray(x, dtype=float)
+    if x_eval is None:
+        x_eval = x
+    x_eval = np.asarray(x_eval, dtype=float)
+    if degrees is None:
+        degrees = range(1, len(x))
+    degrees = [int(d) for d in degrees]
+    if min(degrees) < 0 or max(degrees) >= len(x):
+        raise ValueError("The degrees must be between 0 and len(x) - 1.")
+    if num_draws < 1:
+        raise ValueError("num_draws must be at least 1.")
+    if chunk_size < 1:
+        raise ValueError("chunk_size must be at least 1.")
+
+    # Number of draws and random seed for each chunk.
+    sizes = [min(chunk_size, num_draws - begin) for begin in range(0, num_draws, chunk_size)]
+    seeds = np.random.RandomState(random_seed).randint(0, 2 ** 31 - 1, size=len(sizes))
+    args = [(seed, size, x, x_eval, degrees, err) for seed, size in zip(seeds, sizes)]
+
+    if num_workers is None:
+        num_workers = os.cpu_count() or 1
+    if num_workers <= 1 or len(args) <= 1:
+        results = [_simulate_chunk(*a) for a in args]
+    else:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=num_workers) as executor:
+            results = list(executor.map(_simulate_chunk, *zip(*args)))
+
+    # Combine the means and variances of the chunks (Chan et al.).
+    count, mean, m2, error, noise = results[0]
+    for n, mean_b, m2_b, error_b, noise_b in results[1:]:
+        delta = mean_b - mean
+        total = count + n
+        mean = mean + delta * n / total
+        m2 = m2 + m2_b + delta ** 2 * count * n / total
+        error = error + error_b
+        noise = noise + noise_b
+        count = total
+
+    f_eval = true_func(x_eval)
+    num_values = count * len(x_eval)
+
+    return {'degrees': np.array(degrees),
+            'bias2': ((mean - f_eval) ** 2).mean(axis=1),
+            'variance': (m2 / count).mean(axis=1),
+            'noise': np.full(len(degrees), noise / num_values),
+            'error': error / num_values}
+
+def plot_bias_variance_decomposition(**kwargs):
+    # Plot the curves from bias_variance_decomposition() against the degree.
+    result = bias_variance_decomposition(**kwargs)
+    degrees = result['degrees']
+
+    fig = bk.figure(plot_width=480, plot_height=300,
+                    title='bias-variance decomposition')
+    fig.title.text_font_size = '11pt'
+    fig.line(degrees, result['bias2'], line_color='blue', legend='bias^2')
+    fig.line(degrees, result['variance'], line_color='red', legend='variance')
+    fig.line(degrees, result['noise'], line_color='gray', legend='noise')
+    fig.line(degrees, result['error'], line_color='black', line_dash='dashed',
+             legend='test error')
+    fig.xaxis.axis_label = 'degree of polynomial'
+    fig.xaxis.axis_label_text_font_size = '9pt'
+    fig.yaxis.axis_label = 'squared error'
+    fig.yaxis.axis_label_text_font_size = '9pt'
+    fig.legend.location = 'top_left'
+    bk.show(fig)
+
+    return result
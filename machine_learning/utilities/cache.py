@@ -21,58 +21,2019 @@
 ########################################################################
 
 import os
+import errno
+import mmap
+import json
+import time
 import pickle
+import struct
+import hashlib
+import inspect
+import zipfile
+import uuid
+import zlib
+import bz2
+import lzma
+import functools
+import threading
+import weakref
+import collections
+import concurrent.futures
 import numpy as np
 
 ########################################################################
 
+# Codec used by cache() for compressing pickle-files, see codecs.
+# Set this to e.g. 'zlib' if reading and writing the cache-files
+# takes longer than compressing them, e.g. on a network drive.
+default_compression = None
+
+# Storage backend used by cache() for filenames that do not end with
+# '.npy' or '.npz', see backends. Set this to 'pickle5' to save the
+# numpy arrays inside objects so they are memory-mapped when reloaded.
+default_backend = 'pickle'
+
+########################################################################
+
 
 def cache(cache_path, fn, *args, **kwargs):
     """
-    Cache-wrapper for a function or class. If the cache-file exists
-    then the data is reloaded and returned, otherwise the function
-    is called and the result is saved to cache. The fn-argument can
-    also be a class instead, in which case an object-instance is
-    created and saved to the cache-file.
+    Cache-wrapper for a function or class. If the cache-file exists
+    then the data is reloaded and returned, otherwise the function
+    is called and the result is saved to cache. The fn-argument can
+    also be a class instead, in which case an object-instance is
+    created and saved to the cache-file.
+
+    If the cache_path ends with '.npy' or '.npz' then the data is saved
+    in numpy-format instead of pickle-format, and it is memory-mapped when
+    reloaded, see _save_numpy(). This only works for numpy arrays and
+    tuples, lists or dicts of numpy arrays.
+
+    If default_compression is set then pickle-files are compressed with
+    that codec, see codecs. Compressed and uncompressed cache-files can
+    both be loaded regardless of this setting.
+
+    The cache-file is written atomically so it is never seen half-written.
+    If several processes call this function with the same cache_path then
+    only one of them calls the function, while the others wait for it to
+    finish and then load the cache-file.
+
+    :param cache_path:
+        File-path for the cache-file.
+
+    :param fn:
+        Function or class to be called.
+
+    :param args:
+        Arguments to the function or class-init.
+
+    :param kwargs:
+        Keyword arguments to the function or class-init.
+
+    :return:
+        The result of calling the function or creating the object-instance.
+    """
+
+    obj, _ = _cache(cache_path=cache_path, fn=fn, args=args, kwargs=kwargs,
+                    compression=default_compression)
+
+    return obj
+
+
+def _cache(cache_path, fn, args, kwargs, compression=None):
+    """
+    Implementation of cache() which also returns a boolean
+    whether the data was loaded from the cache-file (True)
+    or it was computed by calling the function (False).
+
+    The compression is only used for pickle-files.
+    """
+
+    # If the cache-file exists.
+    if os.path.exists(cache_path):
+        # Load the cached data from the file.
+        obj = _load(cache_path)
+
+        print("- Data loaded from cache-file: " + cache_path)
+
+        return obj, True
+
+    # The cache-file does not exist. Lock it so only one process
+    # calls the function while other processes wait for the result.
+    with _FileLock(_lock_path(cache_path)):
+        # Another process may have saved the cache-file while we waited.
+        if os.path.exists(cache_path):
+            obj = _load(cache_path)
+
+            print("- Data loaded from cache-file: " + cache_path)
+
+            return obj, True
+
+        # Call the function / class-init with the supplied arguments.
+        obj = fn(*args, **kwargs)
+
+        # Save the data to a cache-file.
+        # Only the pickle-backend can be compressed.
+        if _backend_for_path(cache_path) != 'pickle':
+            compression = None
+        _save(cache_path, obj, compression=compression)
+
+        print("- Data saved to cache-file: " + cache_path)
+
+    return obj, False
+
+
+def update_cache(cache_path, obj):
+    """
+    Overwrite a cache-file with the given object, e.g. after an object
+    that was loaded from the cache-file has been modified. The cache-file
+    is written the same way as in cache().
+
+    :param cache_path:
+        File-path for the cache-file.
+
+    :param obj:
+        Object to save in the cache-file.
+
+    :return:
+        Nothing.
+    """
+
+    # Only the pickle-backend can be compressed.
+    if _backend_for_path(cache_path) == 'pickle':
+        compression = default_compression
+    else:
+        compression = None
+
+    _save(cache_path, obj, compression=compression)
+
+    print("- Data saved to cache-file: " + cache_path)
+
+
+########################################################################
+# Safe writing of cache-files from several processes.
+#
+# Cache-files are first written to a temporary file in the same
+# directory, which is then renamed to the cache-file. The rename is
+# atomic so other processes never see a half-written cache-file.
+#
+# When a cache-file does not exist, a lock-file is used so that only
+# one process calls the function and saves the result, while other
+# processes wait for the lock and then load the cache-file instead of
+# computing the same result again. The lock-files are hidden files
+# named '.<filename>.lock' in the same directory, and they are left
+# there because deleting a lock-file that another process is waiting
+# for would break the locking.
+
+try:
+    import fcntl
+except ImportError:
+    # Windows.
+    fcntl = None
+    import msvcrt
+
+
+def _atomic_write(path, write, mode='wb'):
+    """
+    Write a file atomically.
+
+    :param path:
+        File-path.
+
+    :param write:
+        Function that is called with a file-object for writing the data.
+
+    :param mode:
+        Mode for opening the file, either 'wb' or 'w'.
+
+    :return:
+        Nothing.
+    """
+
+    dir, filename = os.path.split(path)
+
+    # Hidden temporary file that is unique for this process and thread.
+    tmp_filename = '.{0}.{1}.{2}.tmp'.format(filename, os.getpid(), uuid.uuid4().hex)
+    tmp_path = os.path.join(dir, tmp_filename)
+
+    try:
+        with open(tmp_path, mode=mode.replace('w', 'x')) as file:
+            write(file)
+
+            # Ensure the data is on disk before the file is renamed.
+            file.flush()
+            os.fsync(file.fileno())
+
+        os.replace(tmp_path, path)
+    except BaseException:
+        # Delete the temporary file if anything failed.
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+
+        raise
+
+
+def _lock_path(path):
+    """
+    Return the path of the lock-file for the given file.
+    """
+
+    dir, filename = os.path.split(path)
+
+    # Hide the lock-file unless the file is already hidden.
+    if not filename.startswith('.'):
+        filename = '.' + filename
+
+    return os.path.join(dir, filename + '.lock')
+
+
+# Error-codes from msvcrt.locking() when the lock is held by another
+# process, which is EDEADLOCK after it has retried for about 10 seconds.
+_lock_busy_errors = (errno.EACCES, getattr(errno, 'EDEADLOCK', errno.EDEADLK))
+
+
+class _FileLock:
+    def __init__(self, path):
+        """
+        Context-manager for an exclusive lock on a lock-file, which is
+        shared between processes and threads. If the file-system does not
+        support locking then the lock is silently ignored.
+
+        :param path:
+            Path of the lock-file. It is created if it does not exist.
+        """
+
+        self.path = path
+        self._file = None
+
+    def __enter__(self):
+        try:
+            self._file = open(self.path, mode='a+b')
+        except OSError:
+            return self
+
+        try:
+            if fcntl is not None:
+                fcntl.flock(self._file.fileno(), fcntl.LOCK_EX)
+            else:
+                self._file.seek(0)
+                while True:
+                    try:
+                        # This retries for about 10 seconds before failing.
+                        msvcrt.locking(self._file.fileno(), msvcrt.LK_LOCK, 1)
+                        break
+                    except OSError as e:
+                        # The lock is still held by another process,
+                        # so keep waiting. Other errors mean that
+                        # locking is not supported.
+                        if e.errno not in _lock_busy_errors:
+                            raise
+        except OSError:
+            # Locking is not supported by the file-system.
+            self._file.close()
+            self._file = None
+
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self._file is None:
+            return
+
+        try:
+            if fcntl is not None:
+                fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+            else:
+                self._file.seek(0)
+                msvcrt.locking(self._file.fileno(), msvcrt.LK_UNLCK, 1)
+        except OSError:
+            pass
+        finally:
+            self._file.close()
+            self._file = None
+
+
+########################################################################
+# Storage backends for the cache-files.
+#
+# 'pickle' can save any Python object but the whole file must be read
+# and copied into memory when it is loaded.
+#
+# 'numpy' saves numpy arrays in the .npy-format and tuples, lists or
+# dicts of numpy arrays in an uncompressed .npz-file. The arrays are
+# memory-mapped when they are loaded, so reloading a cache-file of
+# several GB takes milliseconds and the data is only read from disk
+# when it is actually used. The memory-mapped arrays are read-only.
+#
+# 'pickle5' can save any Python object using pickle protocol 5, where
+# the data of numpy arrays and other large buffers is written outside
+# the pickle-stream, see _save_pickle5(). The buffers are memory-mapped
+# when they are loaded so the arrays are not copied. This requires
+# Python 3.8 or the pickle5-package. The arrays are read-only.
+
+# Valid names for the storage backends.
+backends = ('pickle', 'numpy', 'pickle5')
+
+# Magic strings at the beginning of .npy and .npz files.
+_npy_magic = b'\x93NUMPY'
+_npz_magic = b'PK\x03\x04'
+
+# Name of the member in a .npz-file that holds the container-type.
+_npz_container = '__container__'
+
+
+def _backend_for_path(path):
+    """
+    Return the default storage backend for the given cache-file,
+    which is 'numpy' for the extensions '.npy' and '.npz',
+    and default_backend for all other extensions.
+    """
+
+    if path.lower().endswith(('.npy', '.npz')):
+        return 'numpy'
+    else:
+        return default_backend
+
+
+def _load(path):
+    """
+    Load and return the object saved in the given cache-file.
+
+    The storage backend is determined from the contents of the file.
+    """
+
+    with open(path, mode='rb') as file:
+        magic = file.read(len(_compressed_magic))
+
+        if magic.startswith(_npy_magic):
+            return _open_npy(path=path, file=file, offset=0)
+        elif magic.startswith(_npz_magic):
+            return _load_npz(path=path)
+        elif magic == _compressed_magic:
+            return _load_compressed(file)
+        elif magic == _pickle5_magic:
+            return _load_pickle5(file)
+        else:
+            file.seek(0)
+            return pickle.load(file)
+
+
+def _save(path, obj, backend=None, compression=None):
+    """
+    Save the object to the given cache-file.
+
+    :param backend:
+        Name of the storage backend, see backends.
+        If None then use _backend_for_path().
+
+    :param compression:
+        Name of the codec for compressing a pickle-file, see codecs.
+        If None then the pickle-file is not compressed.
+        This can only be used with the pickle-backend.
+    """
+
+    if backend is None:
+        backend = _backend_for_path(path)
+
+    if backend == 'numpy':
+        if compression is not None:
+            raise ValueError("The numpy-backend cannot be compressed "
+                             "because the arrays are memory-mapped.")
+
+        if _fallback_backend(path, obj, backend) == 'numpy':
+            _atomic_write(path, lambda file: _save_numpy(file, obj))
+        else:
+            _atomic_write(path, lambda file: pickle.dump(obj, file))
+    elif backend == 'pickle':
+        if compression is None:
+            _atomic_write(path, lambda file: pickle.dump(obj, file))
+        else:
+            _atomic_write(path, lambda file: _save_compressed(file, obj, compression))
+    elif backend == 'pickle5':
+        if compression is not None:
+            raise ValueError("The pickle5-backend cannot be compressed "
+                             "because the buffers are memory-mapped.")
+
+        _atomic_write(path, lambda file: _save_pickle5(file, obj))
+    else:
+        raise ValueError("Unknown backend: " + str(backend))
+
+
+def _check_numpy(obj):
+    """
+    Raise TypeError if obj cannot be saved with the numpy-backend.
+    """
+
+    if not isinstance(obj, np.ndarray):
+        raise TypeError("The numpy-backend can only save numpy arrays "
+                        "and tuples, lists or dicts of numpy arrays, "
+                        "not: " + type(obj).__name__)
+
+    if obj.dtype.hasobject:
+        raise TypeError("The numpy-backend cannot save arrays of Python objects.")
+
+
+def _is_numpy_compatible(obj):
+    """
+    Return boolean whether obj can be saved with the numpy-backend.
+    """
+
+    if isinstance(obj, (tuple, list)):
+        names, arrays = [], list(obj)
+    elif isinstance(obj, dict):
+        names, arrays = list(obj.keys()), list(obj.values())
+    else:
+        names, arrays = [], [obj]
+
+    for name in names:
+        if not isinstance(name, str) or name == _npz_container:
+            return False
+
+    for arr in arrays:
+        try:
+            _check_numpy(arr)
+        except TypeError:
+            return False
+
+    return True
+
+
+def _fallback_backend(path, obj, backend):
+    """
+    Return the backend for saving obj, which is the pickle-backend if
+    the numpy-backend was requested but cannot save the object. This is
+    checked after the object has been computed, so the object is saved
+    anyway instead of being lost. The backend is detected from the
+    contents of the file when it is loaded, see _load().
+    """
+
+    if backend == 'numpy' and not _is_numpy_compatible(obj):
+        print("- Cannot save " + type(obj).__name__ + " with the numpy-backend, "
+              "using the pickle-backend instead: " + path)
+        backend = 'pickle'
+
+    return backend
+
+
+def _save_numpy(file, obj):
+    """
+    Save a numpy array, or a tuple, list or dict of numpy arrays,
+    to a file-object using the numpy-backend.
+
+    A single array is written in the .npy-format. Containers are written
+    as an uncompressed .npz-file with an extra member for the
+    container-type, so they can still be loaded with np.load().
+    """
+
+    if isinstance(obj, np.ndarray):
+        _check_numpy(obj)
+
+        np.save(file, obj, allow_pickle=False)
+
+        return
+
+    if isinstance(obj, (tuple, list)):
+        container = type(obj).__name__
+        items = [('arr_' + str(i), arr) for i, arr in enumerate(obj)]
+    elif isinstance(obj, dict):
+        container = 'dict'
+        items = list(obj.items())
+    else:
+        # Raises TypeError.
+        _check_numpy(obj)
+
+    for name, arr in items:
+        if not isinstance(name, str) or name == _npz_container:
+            raise TypeError("Invalid key for the numpy-backend: " + repr(name))
+        _check_numpy(arr)
+
+    items.append((_npz_container, np.array(container)))
+
+    # The members must be stored uncompressed so they can be memory-mapped.
+    with zipfile.ZipFile(file, mode='w', compression=zipfile.ZIP_STORED,
+                         allowZip64=True) as zf:
+        for name, arr in items:
+            with zf.open(name + '.npy', mode='w', force_zip64=True) as member:
+                np.lib.format.write_array(member, np.asanyarray(arr),
+                                          allow_pickle=False)
+
+
+def _open_npy(path, file, offset):
+    """
+    Memory-map an array in the .npy-format that begins at the given
+    offset of the file.
+
+    :param path:
+        Path of the file.
+
+    :param file:
+        File-object for the same file, opened in binary mode.
+
+    :param offset:
+        Byte-offset in the file where the .npy-data begins.
+
+    :return:
+        Read-only numpy array.
+    """
+
+    # Read the header of the array.
+    file.seek(offset)
+    version = np.lib.format.read_magic(file)
+    if version == (1, 0):
+        shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(file)
+    else:
+        shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(file)
+
+    order = 'F' if fortran_order else 'C'
+
+    # An empty file-region cannot be memory-mapped.
+    if np.prod(shape, dtype=np.int64) == 0 or dtype.itemsize == 0:
+        arr = np.empty(shape=shape, dtype=dtype, order=order)
+        arr.flags.writeable = False
+        return arr
+
+    return np.memmap(path, mode='r', dtype=dtype, shape=shape,
+                     order=order, offset=file.tell())
+
+
+def _load_npz(path):
+    """
+    Load a .npz-file written by _save_numpy() with all its arrays
+    memory-mapped, and return the tuple, list or dict of arrays.
+
+    Compressed members (e.g. from np.savez_compressed) cannot be
+    memory-mapped so they are read into memory instead.
+    """
+
+    arrays = {}
+    container = 'dict'
+
+    with zipfile.ZipFile(path, mode='r') as zf, open(path, mode='rb') as file:
+        for info in zf.infolist():
+            # Name of the array without the extension '.npy'.
+            name = info.filename
+            if name.endswith('.npy'):
+                name = name[:-len('.npy')]
+
+            if info.compress_type == zipfile.ZIP_STORED:
+                # The data begins after the local file-header, which has
+                # a fixed size of 30 bytes followed by the filename and
+                # an extra-field whose lengths are stored at the end.
+                file.seek(info.header_offset + 26)
+                len_name, len_extra = struct.unpack('<HH', file.read(4))
+                offset = info.header_offset + 30 + len_name + len_extra
+
+                arr = _open_npy(path=path, file=file, offset=offset)
+            else:
+                with zf.open(info) as member:
+                    arr = np.lib.format.read_array(member, allow_pickle=False)
+
+            if name == _npz_container:
+                container = str(arr[()])
+            else:
+                arrays[name] = arr
+
+    if container == 'dict':
+        return arrays
+
+    # Restore the order of the arrays in the tuple or list.
+    items = [arrays['arr_' + str(i)] for i in range(len(arrays))]
+
+    if container == 'tuple':
+        return tuple(items)
+    else:
+        return items
+
+
+########################################################################
+# Compressed pickle-files.
+#
+# The pickled data is split into chunks which are compressed and
+# decompressed in parallel using a thread-pool. The codecs from the
+# standard library release the GIL while they are working, so this
+# scales with the number of CPU cores. The file begins with a header
+# that holds the name of the codec, followed by the compressed chunks
+# which are each prefixed with their compressed and raw sizes:
+#
+#   magic | len(codec) | codec | (len(chunk) | raw_len(chunk) | chunk)* | 0 | 0
+
+# Optional fast codecs.
+try:
+    import lz4.frame
+except ImportError:
+    lz4 = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Functions for compressing and decompressing with each codec.
+_codecs = {'zlib': (zlib.compress, zlib.decompress),
+           'bz2': (bz2.compress, bz2.decompress),
+           'lzma': (lzma.compress, lzma.decompress)}
+
+if lz4 is not None:
+    _codecs['lz4'] = (lz4.frame.compress, lz4.frame.decompress)
+
+if zstandard is not None:
+    # The compressor-objects are not thread-safe so make one per call.
+    _codecs['zstd'] = (lambda data: zstandard.ZstdCompressor().compress(data),
+                       lambda data: zstandard.ZstdDecompressor().decompress(data))
+
+# Names of the codecs that are available.
+codecs = tuple(sorted(_codecs))
+
+# Magic string at the beginning of a compressed pickle-file.
+_compressed_magic = b'CACHEZ\x00\x01'
+
+# Number of bytes in each chunk before it is compressed.
+_chunk_size = 4 * 2 ** 20
+
+# Sizes of a compressed chunk and its raw data.
+_chunk_header = struct.Struct('<QQ')
+
+# Number of threads for compressing and decompressing chunks.
+_num_threads = os.cpu_count() or 1
+
+
+def _get_codec(compression):
+    """
+    Return the compress- and decompress-functions for the named codec.
+    """
+
+    try:
+        return _codecs[compression]
+    except KeyError:
+        raise ValueError("Codec is not available: " + str(compression) +
+                         ". Available codecs: " + ", ".join(codecs))
+
+
+class _CompressedWriter:
+    def __init__(self, file, compress, executor):
+        """
+        File-like object that compresses the data written to it in
+        chunks using a thread-pool, and writes the compressed chunks
+        to the file in their original order.
+        """
+
+        self._file = file
+        self._compress = compress
+        self._executor = executor
+
+        # Data that has not yet been submitted for compression.
+        self._buffer = bytearray()
+
+        # Chunks that are being compressed, in order.
+        self._pending = collections.deque()
+
+    def write(self, data):
+        self._buffer += data
+
+        while len(self._buffer) >= _chunk_size:
+            chunk = bytes(self._buffer[:_chunk_size])
+            del self._buffer[:_chunk_size]
+            self._submit(chunk)
+
+        return len(data)
+
+    def _submit(self, chunk):
+        self._pending.append((len(chunk), self._executor.submit(self._compress, chunk)))
+
+        # Limit the number of chunks held in memory.
+        while len(self._pending) > 2 * _num_threads:
+            self._write_next()
+
+    def _write_next(self):
+        raw_len, future = self._pending.popleft()
+        compressed = future.result()
+
+        self._file.write(_chunk_header.pack(len(compressed), raw_len))
+        self._file.write(compressed)
+
+    def close(self):
+        if len(self._buffer) > 0:
+            self._submit(bytes(self._buffer))
+            self._buffer = bytearray()
+
+        while len(self._pending) > 0:
+            self._write_next()
+
+        # End-marker.
+        self._file.write(_chunk_header.pack(0, 0))
+
+
+class _CompressedReader:
+    def __init__(self, file, decompress, executor):
+        """
+        File-like object that reads compressed chunks from the file and
+        decompresses them using a thread-pool, while the next chunks are
+        being decompressed in the background.
+        """
+
+        self._file = file
+        self._decompress = decompress
+        self._executor = executor
+
+        # Decompressed data that has not yet been read.
+        self._buffer = b''
+        self._pos = 0
+
+        # Chunks that are being decompressed, in order.
+        self._pending = collections.deque()
+
+        # Boolean whether the end-marker has been read.
+        self._eof = False
+
+        self._fill_pending()
+
+    def _fill_pending(self):
+        while not self._eof and len(self._pending) < 2 * _num_threads:
+            compressed_len, raw_len = _chunk_header.unpack(self._file.read(_chunk_header.size))
+
+            if compressed_len == 0 and raw_len == 0:
+                self._eof = True
+            else:
+                compressed = self._file.read(compressed_len)
+                self._pending.append(self._executor.submit(self._decompress, compressed))
+
+    def _next_chunk(self):
+        """
+        Replace the buffer with the next decompressed chunk.
+        Any unread data in the buffer must be used before this is called.
+        Returns False if there are no more chunks.
+        """
+
+        if len(self._pending) == 0:
+            self._buffer = b''
+            self._pos = 0
+            return False
+
+        self._buffer = self._pending.popleft().result()
+        self._pos = 0
+
+        self._fill_pending()
+
+        return True
+
+    def _take(self, size):
+        """
+        Return up to size bytes from the buffer and advance the position.
+        """
+
+        data = self._buffer[self._pos:self._pos + size]
+        self._pos += len(data)
+
+        return data
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            # Read all the remaining data.
+            parts = [self._take(len(self._buffer) - self._pos)]
+            while self._next_chunk():
+                parts.append(self._take(len(self._buffer)))
+            return b''.join(parts)
+
+        # Small reads are sliced directly from the current chunk.
+        if len(self._buffer) - self._pos >= size:
+            return self._take(size)
+
+        # Large reads collect the chunks in a list which is only joined
+        # once, so reading a large array does not copy the data repeatedly.
+        parts = [self._take(size)]
+        remaining = size - len(parts[0])
+
+        while remaining > 0 and self._next_chunk():
+            part = self._take(remaining)
+            parts.append(part)
+            remaining -= len(part)
+
+        return b''.join(parts)
+
+    def readinto(self, buffer):
+        # Copy the chunks directly into the buffer, e.g. for pickle
+        # protocol 5 which reads large arrays into pre-allocated memory.
+        view = memoryview(buffer).cast('B')
+        num_bytes = 0
+
+        while num_bytes < len(view):
+            if self._pos >= len(self._buffer) and not self._next_chunk():
+                break
+
+            part = self._take(len(view) - num_bytes)
+            view[num_bytes:num_bytes + len(part)] = part
+            num_bytes += len(part)
+
+        return num_bytes
+
+    def readline(self):
+        parts = []
+
+        while True:
+            end = self._buffer.find(b'\n', self._pos)
+
+            if end >= 0:
+                parts.append(self._take(end + 1 - self._pos))
+                break
+
+            parts.append(self._take(len(self._buffer) - self._pos))
+
+            if not self._next_chunk():
+                break
+
+        return b''.join(parts)
+
+
+def _save_compressed(file, obj, compression):
+    """
+    Pickle the object and write it compressed to a file-object.
+
+    :param compression:
+        Name of the codec, see codecs.
+    """
+
+    compress, _ = _get_codec(compression)
+
+    name = compression.encode('ascii')
+
+    file.write(_compressed_magic)
+    file.write(struct.pack('<B', len(name)))
+    file.write(name)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=_num_threads) as executor:
+        writer = _CompressedWriter(file=file, compress=compress, executor=executor)
+        pickle.dump(obj, writer, protocol=4)
+        writer.close()
+
+
+def _load_compressed(file):
+    """
+    Load a compressed pickle-file from a file-object
+    that is positioned right after the magic string.
+    """
+
+    len_name, = struct.unpack('<B', file.read(1))
+    compression = file.read(len_name).decode('ascii')
+
+    _, decompress = _get_codec(compression)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=_num_threads) as executor:
+        reader = _CompressedReader(file=file, decompress=decompress, executor=executor)
+        obj = pickle.load(reader)
+
+    return obj
+
+
+########################################################################
+# Pickle-files with out-of-band buffers.
+#
+# With pickle protocol 5 the data of numpy arrays and other large
+# buffers can be handled outside of the pickle-stream. The buffers are
+# written as separate segments after the pickle-stream, each aligned to
+# 64 bytes. When the file is loaded, it is memory-mapped and the arrays
+# are created directly on top of the segments, so they are not copied.
+#
+#   magic | len(pickle) | num_buffers | (offset | len)* | pickle | buffers
+
+# Pickle-module with support for protocol 5.
+if pickle.HIGHEST_PROTOCOL >= 5:
+    _pickle5 = pickle
+else:
+    try:
+        import pickle5 as _pickle5
+    except ImportError:
+        _pickle5 = None
+
+# Magic string at the beginning of a pickle5-file.
+_pickle5_magic = b'CACHEP5\x01'
+
+# Alignment in bytes of the buffer-segments.
+_pickle5_alignment = 64
+
+
+def _check_pickle5():
+    """
+    Raise ValueError if pickle protocol 5 is not available.
+    """
+
+    if _pickle5 is None:
+        raise ValueError("The pickle5-backend requires Python 3.8 "
+                         "or the pickle5-package.")
+
+
+def _save_pickle5(file, obj):
+    """
+    Pickle the object with protocol 5 and write it to a file-object
+    with the large buffers written out-of-band as separate segments.
+    """
+
+    _check_pickle5()
+
+    # Pickle the object and collect the out-of-band buffers.
+    buffers = []
+    data = _pickle5.dumps(obj, protocol=5, buffer_callback=buffers.append)
+    buffers = [buffer.raw() for buffer in buffers]
+
+    # Size of the header with the table of buffers.
+    header_size = len(_pickle5_magic) + 16 + 16 * len(buffers)
+
+    # Offsets of the buffer-segments.
+    offsets = []
+    end = header_size + len(data)
+    for buffer in buffers:
+        offset = -(-end // _pickle5_alignment) * _pickle5_alignment
+        offsets.append(offset)
+        end = offset + buffer.nbytes
+
+    # Write the header.
+    file.write(_pickle5_magic)
+    file.write(struct.pack('<QQ', len(data), len(buffers)))
+    for offset, buffer in zip(offsets, buffers):
+        file.write(struct.pack('<QQ', offset, buffer.nbytes))
+
+    # Write the pickle-stream.
+    file.write(data)
+    pos = header_size + len(data)
+
+    # Write the buffers with padding for the alignment.
+    for offset, buffer in zip(offsets, buffers):
+        file.write(b'\x00' * (offset - pos))
+        file.write(buffer)
+        pos = offset + buffer.nbytes
+
+
+def _load_pickle5(file):
+    """
+    Load a pickle5-file from a file-object that is positioned right
+    after the magic string. The buffers are memory-mapped.
+    """
+
+    _check_pickle5()
+
+    len_data, num_buffers = struct.unpack('<QQ', file.read(16))
+    table = [struct.unpack('<QQ', file.read(16)) for _ in range(num_buffers)]
+
+    data = file.read(len_data)
+
+    if num_buffers == 0:
+        return _pickle5.loads(data)
+
+    # Memory-map the file. The mapping stays open as long as
+    # any of the arrays that use it are still alive.
+    mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    view = memoryview(mapped)
+
+    buffers = [view[offset:offset + length] for offset, length in table]
+
+    return _pickle5.loads(data, buffers=buffers)
+
+
+########################################################################
+# Content-addressed cache-files.
+#
+# The cache()-function above only checks whether the cache-file exists,
+# so it returns stale data if the arguments to the function are changed.
+# The functions below instead compute a key from the function and its
+# arguments and use that key as the filename inside a cache-directory.
+# An index-file in the cache-directory maps each key to its cache-file.
+
+# Filename of the index-file in the cache-directory.
+_index_filename = ".cache_index.json"
+
+
+def _fn_name(fn):
+    """
+    Return the fully qualified name of a function or class,
+    e.g. 'utilities.dataset.DataSet'.
+    """
+
+    if isinstance(fn, functools.partial):
+        return 'functools.partial(' + _fn_name(fn.func) + ')'
+
+    module = getattr(fn, '__module__', None) or ''
+    name = getattr(fn, '__qualname__', None) or getattr(fn, '__name__', repr(fn))
+
+    return module + '.' + name
+
+
+def _fn_fingerprint(fn, version=None):
+    """
+    Return a string identifying the implementation of a function or class.
+
+    If a version-tag is given then it is used, otherwise the source-code
+    is used so the key changes when the function is edited. If the source
+    is not available (e.g. builtin functions) then an empty string is
+    returned and only the function's name is used in the key.
+    """
+
+    if version is not None:
+        return 'version:' + str(version)
+
+    if isinstance(fn, functools.partial):
+        return _fn_fingerprint(fn.func)
+
+    try:
+        source = inspect.getsource(fn)
+    except (OSError, TypeError):
+        return ''
+
+    return 'source:' + hashlib.sha256(source.encode('utf-8')).hexdigest()
+
+
+def _hash_update(h, obj):
+    """
+    Update the hash-object h with the contents of obj.
+
+    Numpy arrays are hashed from their raw data, containers are hashed
+    recursively, dicts are hashed in sorted key-order and sets are hashed
+    in the sorted order of their items' hashes, so equal arguments always
+    give the same hash.
+
+    Other objects are pickled, which is only supported for objects whose
+    pickle is the same in every process. E.g. an object holding a set of
+    strings is not supported, because the order of the set depends on
+    the random hash-seed of the Python process.
+    """
+
+    if isinstance(obj, np.ndarray):
+        h.update(b'ndarray')
+        h.update(obj.dtype.str.encode('utf-8'))
+        h.update(str(obj.shape).encode('utf-8'))
+
+        if obj.dtype.hasobject:
+            h.update(pickle.dumps(obj.tolist(), protocol=4))
+        else:
+            h.update(np.ascontiguousarray(obj).view(np.uint8).data)
+    elif isinstance(obj, (list, tuple)):
+        h.update(type(obj).__name__.encode('utf-8'))
+        h.update(str(len(obj)).encode('utf-8'))
+        for item in obj:
+            _hash_update(h, item)
+    elif isinstance(obj, dict):
+        h.update(b'dict')
+        h.update(str(len(obj)).encode('utf-8'))
+        for key in sorted(obj, key=repr):
+            _hash_update(h, key)
+            _hash_update(h, obj[key])
+    elif isinstance(obj, (set, frozenset)):
+        h.update(type(obj).__name__.encode('utf-8'))
+        h.update(str(len(obj)).encode('utf-8'))
+
+        # Hash each item separately and use the hashes in sorted order,
+        # because the order of the items varies between processes.
+        digests = []
+        for item in obj:
+            h_item = hashlib.new(h.name)
+            _hash_update(h_item, item)
+            digests.append(h_item.digest())
+
+        for digest in sorted(digests):
+            h.update(digest)
+    elif obj is None or isinstance(obj, (bool, int, float, complex, str, bytes)):
+        h.update(type(obj).__name__.encode('utf-8'))
+        h.update(repr(obj).encode('utf-8'))
+    else:
+        h.update(b'pickle')
+        h.update(pickle.dumps(obj, protocol=4))
+
+
+def cache_key(fn, args=(), kwargs=None, version=None):
+    """
+    Compute the cache-key for calling fn(*args, **kwargs).
+
+    The key is a hash of the function's qualified name, its source-code
+    or version-tag, and all the arguments. For a bound method the object
+    it is bound to is also part of the key, and for functools.partial
+    the wrapped function and its arguments are used.
+
+    The arguments are bound to the function's signature with the default
+    values filled in, so e.g. f(5) and f(a=5) have the same key.
+
+    :param fn:
+        Function or class to be called.
+
+    :param args:
+        Tuple with arguments to the function or class-init.
+
+    :param kwargs:
+        Dict with keyword arguments to the function or class-init.
+
+    :param version:
+        Optional version-tag for the function. If None then the
+        source-code of the function is used instead.
+
+    :return:
+        String with the hex-digest of the key.
+    """
+
+    return _args_key(_fn_hasher(fn, version=version), args=args, kwargs=kwargs,
+                     signature=_fn_signature(fn))
+
+
+def _fn_hasher(fn, version=None):
+    """
+    Return a hash-object that has been updated with the function's
+    name and fingerprint, which is the first part of the cache-key.
+    This can be computed once and copied for each call, because
+    finding the source-code of the function is slow.
+    """
+
+    h = hashlib.sha256()
+
+    _hash_update(h, _fn_name(fn))
+    _hash_update(h, _fn_fingerprint(fn, version=version))
+
+    if isinstance(fn, functools.partial):
+        # The arguments that are already given to the wrapped function.
+        _hash_update(h, tuple(fn.args))
+        _hash_update(h, dict(fn.keywords))
+        fn = fn.func
+
+    # The object for a bound method, so the methods of different objects
+    # have different keys. Builtin functions are bound to their module.
+    obj = getattr(fn, '__self__', None)
+    if obj is not None and not inspect.ismodule(obj):
+        _hash_update(h, 'self')
+        _hash_update(h, obj)
+
+    return h
+
+
+def _fn_signature(fn):
+    """
+    Return the signature of the function or class,
+    or None if it is not available e.g. for some builtin functions.
+    """
+
+    try:
+        return inspect.signature(fn)
+    except (ValueError, TypeError):
+        return None
+
+
+def _args_key(fn_hasher, args=(), kwargs=None, signature=None):
+    """
+    Return the cache-key from a copy of the hash-object from _fn_hasher()
+    updated with the arguments.
+
+    If the signature of the function is given then the arguments are
+    bound to it with the default values filled in, so the key does not
+    depend on how the arguments were passed.
+    """
+
+    if kwargs is None:
+        kwargs = {}
+
+    h = fn_hasher.copy()
+
+    bound = None
+    if signature is not None:
+        try:
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+        except TypeError:
+            # The arguments do not match the signature,
+            # so the function-call will fail anyway.
+            bound = None
+
+    if bound is not None:
+        _hash_update(h, 'bound')
+        _hash_update(h, dict(bound.arguments))
+    else:
+        _hash_update(h, tuple(args))
+        _hash_update(h, dict(kwargs))
+
+    return h.hexdigest()
+
+
+def _read_index(cache_dir):
+    """
+    Return the dict from the index-file in the cache-directory,
+    or an empty dict if there is no index-file.
+    """
+
+    index_path = os.path.join(cache_dir, _index_filename)
+
+    try:
+        with open(index_path, mode='r') as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return {}
+
+
+def _write_index(cache_dir, index):
+    """
+    Write the dict to the index-file in the cache-directory.
+    """
+
+    index_path = os.path.join(cache_dir, _index_filename)
+
+    _atomic_write(index_path, mode='w',
+                  write=lambda file: json.dump(index, file, indent=1, sort_keys=True))
+
+
+# Extensions that are tried when looking up the cache-file for a key.
+_keyed_extensions = ('.pkl', '.npy', '.npz')
+
+
+def _keyed_extension(obj, backend):
+    """
+    Return the file-extension for saving obj with the given backend.
+    """
 
-    :param cache_path:
-        File-path for the cache-file.
+    if backend == 'numpy':
+        return '.npy' if isinstance(obj, np.ndarray) else '.npz'
+    else:
+        # Both pickle-backends.
+        return '.pkl'
+
+
+def _find_keyed_file(cache_dir, key):
+    """
+    Return the path of the cache-file for the key in the cache-directory,
+    or None if it does not exist.
+    """
+
+    # Use the filename from the index-file if the key is found there.
+    filename = _read_index(cache_dir).get(key, {}).get('file')
+    if filename is not None:
+        path = os.path.join(cache_dir, filename)
+        if os.path.exists(path):
+            return path
+
+    # Otherwise try all the possible filenames for the key.
+    for ext in _keyed_extensions:
+        path = os.path.join(cache_dir, key + ext)
+        if os.path.exists(path):
+            return path
+
+    return None
+
+
+def cache_keyed(cache_dir, fn, args=(), kwargs=None, version=None,
+                backend='pickle', compression=None):
+    """
+    Cache-wrapper for a function or class, similar to cache() but the
+    cache-file is determined from a key that is computed from the function
+    and its arguments, see cache_key(). If the arguments are changed then
+    a new cache-file is created instead of returning stale data, so e.g.
+    every result of a parameter-sweep can be reused safely.
+
+    The cache-files are saved in cache_dir together with an index-file
+    that maps the keys to the cache-files.
+
+    Note that the arguments are passed as a tuple and a dict instead of
+    *args and **kwargs so they cannot clash with the arguments of this
+    function.
+
+    :param cache_dir:
+        Directory for the cache-files.
 
     :param fn:
         Function or class to be called.
 
     :param args:
-        Arguments to the function or class-init.
+        Tuple with arguments to the function or class-init.
 
     :param kwargs:
-        Keyword arguments to the function or class-init.
+        Dict with keyword arguments to the function or class-init.
+
+    :param version:
+        Optional version-tag for the function. If None then the
+        source-code of the function is used in the key, so the
+        cache-file is recomputed when the function is edited.
+
+    :param backend:
+        Storage backend used when the cache-file is created, see backends.
+        This does not change the key, so a result that was already saved
+        with another backend is reloaded from that cache-file.
+
+    :param compression:
+        Codec for compressing pickle-files, see codecs.
+        If None then the pickle-files are not compressed.
 
     :return:
         The result of calling the function or creating the object-instance.
     """
 
-    # If the cache-file exists.
-    if os.path.exists(cache_path):
+    obj, _, _ = _cache_keyed(cache_dir=cache_dir, fn=fn, args=args,
+                             kwargs=kwargs, version=version, backend=backend,
+                             compression=compression)
+
+    return obj
+
+
+def _cache_keyed(cache_dir, fn, args=(), kwargs=None, version=None,
+                 backend='pickle', compression=None, key=None):
+    """
+    Implementation of cache_keyed() which also returns the path of the
+    cache-file, and a boolean whether the data was loaded from the
+    cache-file (True) or it was computed by calling the function (False).
+
+    The key can be given if it has already been computed, see cache_key().
+    """
+
+    if kwargs is None:
+        kwargs = {}
+
+    # Create the cache-directory if it does not exist.
+    if not os.path.exists(cache_dir):
+        os.makedirs(cache_dir)
+
+    # Key for this function and its arguments.
+    if key is None:
+        key = cache_key(fn=fn, args=args, kwargs=kwargs, version=version)
+
+    # Full path for an existing cache-file, or None.
+    cache_path = _find_keyed_file(cache_dir, key)
+
+    if cache_path is not None:
         # Load the cached data from the file.
-        with open(cache_path, mode='rb') as file:
-            obj = pickle.load(file)
+        obj = _load(cache_path)
 
         print("- Data loaded from cache-file: " + cache_path)
-    else:
-        # The cache-file does not exist.
+
+        return obj, cache_path, True
+
+    # The cache-file does not exist. Lock the key so only one process
+    # calls the function while other processes wait for the result.
+    with _FileLock(_lock_path(os.path.join(cache_dir, key))):
+        # Another process may have saved the cache-file while we waited.
+        cache_path = _find_keyed_file(cache_dir, key)
+
+        if cache_path is not None:
+            obj = _load(cache_path)
+
+            print("- Data loaded from cache-file: " + cache_path)
+
+            return obj, cache_path, True
 
         # Call the function / class-init with the supplied arguments.
         obj = fn(*args, **kwargs)
 
+        # Use the pickle-backend if the numpy-backend cannot save the object.
+        backend = _fallback_backend(os.path.join(cache_dir, key), obj, backend)
+
+        # Filename and full path for the cache-file.
+        filename = key + _keyed_extension(obj, backend)
+        cache_path = os.path.join(cache_dir, filename)
+
         # Save the data to a cache-file.
-        with open(cache_path, mode='wb') as file:
-            pickle.dump(obj, file)
+        _save(cache_path, obj, backend=backend, compression=compression)
 
-        print("- Data saved to cache-file: " + cache_path)
+    # Add the cache-file to the index.
+    with _FileLock(_lock_path(os.path.join(cache_dir, _index_filename))):
+        index = _read_index(cache_dir)
+        index[key] = {'file': filename,
+                      'function': _fn_name(fn),
+                      'version': version,
+                      'created': time.time()}
+        _write_index(cache_dir, index)
+
+    print("- Data saved to cache-file: " + cache_path)
+
+    return obj, cache_path, False
+
+
+########################################################################
+# In-process memory-cache in front of the cache-files.
+#
+# Loading a cache-file always reads and deserializes the data again,
+# even if the same object was loaded a moment ago in the same process.
+# The functions below keep the most recently used objects in memory,
+# so repeated calls return the live object immediately. Note that the
+# same object is returned every time, so it should not be modified.
+
+
+class _MemoryCache:
+    def __init__(self, maxsize=128):
+        """
+        Thread-safe dict with a maximum number of items, where the
+        least recently used item is removed when it is full.
+
+        :param maxsize:
+            Maximum number of items. If None then there is no limit.
+        """
+
+        self.maxsize = maxsize
+
+        self.hits = 0
+        self.misses = 0
+
+        self._data = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """
+        Return the item for the key, or default if it is not found.
+        """
+
+        with self._lock:
+            if key in self._data:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return self._data[key]
+            else:
+                self.misses += 1
+                return default
+
+    def put(self, key, value):
+        """
+        Save the item for the key, and remove the least
+        recently used item if there are too many.
+        """
+
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+
+            if self.maxsize is not None:
+                while len(self._data) > self.maxsize:
+                    self._data.popitem(last=False)
+
+    def clear(self):
+        """
+        Remove all items.
+        """
+
+        with self._lock:
+            self._data.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def __len__(self):
+        return len(self._data)
+
+
+# Marker for items that are not found in a _MemoryCache.
+_missing = object()
+
+# Memory-cache used by cache_in_memory().
+_memory_cache = _MemoryCache(maxsize=32)
+
+
+def cache_in_memory(cache_path, fn, *args, **kwargs):
+    """
+    Same as cache() but the object is also kept in memory, so calling
+    this again with the same cache_path returns the object without
+    reloading the cache-file. The object is reloaded if the cache-file
+    has been changed or deleted.
+
+    :return:
+        The result of calling the function or creating the object-instance.
+    """
+
+    def _file_key():
+        # The memory-cache is only valid for the same version of the file.
+        try:
+            stat = os.stat(cache_path)
+        except OSError:
+            return None
+
+        return os.path.abspath(cache_path), stat.st_mtime_ns, stat.st_size
+
+    key = _file_key()
+
+    if key is not None:
+        obj = _memory_cache.get(key, _missing)
+        if obj is not _missing:
+            return obj
+
+    obj = cache(cache_path, fn, *args, **kwargs)
+
+    # The cache-file was possibly just created so get the key again.
+    key = _file_key()
+    if key is not None:
+        _memory_cache.put(key, obj)
 
     return obj
 
 
+def cached(dir=None, memory=True, maxsize=128, version=None, backend='pickle',
+           compression=None):
+    """
+    Decorator for caching the results of a function or class.
+
+    The results are saved in a two-tier cache. The first tier keeps the
+    most recently used results in memory, so repeated calls in the same
+    process return the live object without any deserialization. The second
+    tier saves the results to cache-files in a directory using
+    cache_keyed(), so they persist between processes.
+
+    Example:
+
+        @cached(dir='cache/', memory=True)
+        def expensive_function(a, b):
+            return a * b
+
+    :param dir:
+        Directory for the cache-files. If None then only the memory-tier
+        is used.
+
+    :param memory:
+        Boolean whether to use the memory-tier.
+
+    :param maxsize:
+        Maximum number of results in the memory-tier.
+        If None then there is no limit.
+
+    :param version:
+        Optional version-tag for the function, see cache_key().
+
+    :param backend:
+        Storage backend for the cache-files, see backends.
+
+    :param compression:
+        Codec for compressing pickle-files, see codecs.
+
+    :return:
+        Decorator-function. The decorated function also has the functions
+        cache_clear() for clearing the memory-tier, and cache_info() which
+        returns a dict with statistics for the memory-tier.
+    """
+
+    if dir is None and not memory:
+        raise ValueError("Either dir or memory must be used.")
+
+    def decorator(fn):
+        memory_cache = _MemoryCache(maxsize=maxsize)
+
+        # The function's part of the key is only computed once,
+        # so each call only has to hash the arguments.
+        fn_hasher = _fn_hasher(fn, version=version)
+        signature = _fn_signature(fn)
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            key = _args_key(fn_hasher, args=args, kwargs=kwargs, signature=signature)
+
+            # Try the memory-tier first.
+            if memory:
+                obj = memory_cache.get(key, _missing)
+                if obj is not _missing:
+                    return obj
+
+            # Then the disk-tier, which also calls the function if needed.
+            if dir is not None:
+                obj, _, _ = _cache_keyed(cache_dir=dir, fn=fn, args=args,
+                                         kwargs=kwargs, version=version,
+                                         backend=backend, compression=compression,
+                                         key=key)
+            else:
+                obj = fn(*args, **kwargs)
+
+            if memory:
+                memory_cache.put(key, obj)
+
+            return obj
+
+        def cache_info():
+            return {'hits': memory_cache.hits,
+                    'misses': memory_cache.misses,
+                    'maxsize': memory_cache.maxsize,
+                    'currsize': len(memory_cache)}
+
+        wrapper.cache_clear = memory_cache.clear
+        wrapper.cache_info = cache_info
+
+        return wrapper
+
+    return decorator
+
+
+########################################################################
+# Management of a cache-directory.
+
+
+class CacheManager:
+    # Filename of the file with access-times and -counts
+    # for the cache-files in the cache-directory.
+    _access_filename = ".cache_access.json"
+
+    # Valid eviction policies.
+    policies = ('lru', 'lfu')
+
+    # Number of seconds between writing the access-times and -counts to
+    # the access-file. They are kept in memory in between, so a cache-hit
+    # does not have to rewrite the access-file. They are also written
+    # before cache-files are evicted or purged, by flush(), and when the
+    # object is deleted or the program exits.
+    flush_interval = 60.0
+
+    def __init__(self, cache_dir, max_bytes=None, policy='lru', compression=None):
+        """
+        Manage the cache-files in a directory.
+
+        The cache-files are created by calling the cache()- and
+        cache_keyed()-methods of this object, which work like the
+        functions with the same names. The time and number of accesses
+        for each cache-file are saved in the cache-directory, and when
+        the total size of the cache-files exceeds max_bytes then the
+        least recently used (policy='lru') or least frequently used
+        (policy='lfu') cache-files are deleted.
+
+        Hidden files whose names begin with a dot are not considered
+        to be cache-files, so they are never listed or deleted.
+
+        :param cache_dir:
+            Directory for the cache-files.
+
+        :param max_bytes:
+            Maximum total size of the cache-files in bytes.
+            If None then cache-files are only deleted by purge().
+
+        :param policy:
+            Eviction policy, either 'lru' or 'lfu'.
+
+        :param compression:
+            Codec for compressing the pickle-files, see codecs.
+
+        :return:
+            Object instance.
+        """
+
+        if policy not in self.policies:
+            raise ValueError("Unknown eviction policy: " + str(policy))
+
+        # Directory for the cache-files.
+        self.cache_dir = cache_dir
+
+        # Maximum total size of the cache-files.
+        self.max_bytes = max_bytes
+
+        # Eviction policy.
+        self.policy = policy
+
+        # Codec for compressing the pickle-files.
+        self.compression = compression
+
+        # Statistics for the calls made through this object.
+        self.stats = {'hits': 0,
+                      'misses': 0,
+                      'bytes_read': 0,
+                      'bytes_written': 0,
+                      'load_time': 0.0,
+                      'compute_time': 0.0,
+                      'evictions': 0}
+
+        # Access-times and -counts that have not been written to the
+        # access-file yet. The dict is only modified in-place, so it can
+        # also be written by the finalizer below.
+        self._pending = {}
+        self._pending_lock = threading.Lock()
+        self._last_flush = time.time()
+
+        # Create the cache-directory if it does not exist.
+        if not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+
+        # Write the pending accesses when the object is deleted
+        # or the program exits.
+        weakref.finalize(self, CacheManager._flush_access,
+                         cache_dir, self._pending, self._pending_lock)
+
+    def cache(self, filename, fn, *args, **kwargs):
+        """
+        Same as the cache()-function but the cache-file is
+        saved with the given filename in the cache-directory.
+
+        :param filename:
+            Filename for the cache-file, without the directory.
+
+        :return:
+            The result of calling the function or creating the object-instance.
+        """
+
+        start_time = time.time()
+
+        cache_path = os.path.join(self.cache_dir, filename)
+        obj, hit = _cache(cache_path=cache_path, fn=fn, args=args, kwargs=kwargs,
+                          compression=self.compression)
+
+        self._record(cache_path=cache_path, hit=hit,
+                     duration=time.time() - start_time)
+
+        return obj
+
+    def cache_keyed(self, fn, args=(), kwargs=None, version=None,
+                    backend='pickle'):
+        """
+        Same as the cache_keyed()-function using the cache-directory.
+
+        :return:
+            The result of calling the function or creating the object-instance.
+        """
+
+        # Compression is only used for pickle-files.
+        compression = self.compression if backend == 'pickle' else None
+
+        start_time = time.time()
+
+        obj, cache_path, hit = _cache_keyed(cache_dir=self.cache_dir, fn=fn,
+                                            args=args, kwargs=kwargs,
+                                            version=version, backend=backend,
+                                            compression=compression)
+
+        self._record(cache_path=cache_path, hit=hit,
+                     duration=time.time() - start_time)
+
+        return obj
+
+    def _read_access(self):
+        """
+        Return the dict with access-times and -counts for the cache-files.
+        """
+
+        path = os.path.join(self.cache_dir, self._access_filename)
+
+        try:
+            with open(path, mode='r') as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return {}
+
+    def _write_access(self, access):
+        """
+        Write the dict with access-times and -counts for the cache-files.
+        """
+
+        path = os.path.join(self.cache_dir, self._access_filename)
+
+        _atomic_write(path, mode='w',
+                      write=lambda file: json.dump(access, file, indent=1, sort_keys=True))
+
+    def _lock(self, filename):
+        """
+        Return a _FileLock for the given metadata-file in the cache-directory.
+        """
+
+        return _FileLock(_lock_path(os.path.join(self.cache_dir, filename)))
+
+    def _record(self, cache_path, hit, duration):
+        """
+        Update the statistics and the access-time and -count after
+        a cache-file has been used, and evict cache-files if the
+        cache-directory has grown too big.
+        """
+
+        filename = os.path.basename(cache_path)
+        num_bytes = _entry_size(cache_path)
+
+        if hit:
+            self.stats['hits'] += 1
+            self.stats['bytes_read'] += num_bytes
+            self.stats['load_time'] += duration
+        else:
+            self.stats['misses'] += 1
+            self.stats['bytes_written'] += num_bytes
+            self.stats['compute_time'] += duration
+
+        now = time.time()
+
+        # Only update the access in memory, see flush_interval.
+        with self._pending_lock:
+            record = self._pending.setdefault(filename, {'count': 0})
+            record['count'] += 1
+            record['accessed'] = now
+
+        if now - self._last_flush >= self.flush_interval:
+            self.flush()
+
+        # A new cache-file was created so the budget may be exceeded.
+        # The cache-file that was just created is never evicted.
+        if not hit and self.max_bytes is not None:
+            self.evict(keep=[filename])
+
+    @staticmethod
+    def _merge_access(access, pending):
+        """
+        Add the pending access-times and -counts to the dict from the
+        access-file, which is modified in-place.
+        """
+
+        for filename, pending_record in pending.items():
+            record = access.setdefault(filename, {'count': 0})
+            record['count'] += pending_record['count']
+            record['accessed'] = max(record.get('accessed', 0.0),
+                                     pending_record['accessed'])
+
+    @staticmethod
+    def _flush_access(cache_dir, pending, pending_lock):
+        """
+        Write the pending access-times and -counts to the access-file
+        in the cache-directory, and clear the dict with pending accesses.
+        """
+
+        with pending_lock:
+            pending_copy = dict(pending)
+            pending.clear()
+
+        if len(pending_copy) == 0 or not os.path.isdir(cache_dir):
+            return
+
+        path = os.path.join(cache_dir, CacheManager._access_filename)
+
+        with _FileLock(_lock_path(path)):
+            try:
+                with open(path, mode='r') as file:
+                    access = json.load(file)
+            except (OSError, ValueError):
+                access = {}
+
+            CacheManager._merge_access(access, pending_copy)
+
+            _atomic_write(path, mode='w',
+                          write=lambda file: json.dump(access, file, indent=1, sort_keys=True))
+
+    def flush(self):
+        """
+        Write the access-times and -counts that are kept in memory
+        to the access-file in the cache-directory.
+        """
+
+        self._last_flush = time.time()
+
+        self._flush_access(self.cache_dir, self._pending, self._pending_lock)
+
+    def entries(self):
+        """
+        Return a list with a dict for each cache-file in the
+        cache-directory, sorted in the order they would be evicted.
+
+        Each dict has the keys: 'file' (filename), 'bytes' (size of the
+        cache-file), 'accessed' (time of the last access in seconds since
+        the epoch) and 'count' (number of accesses). Cache-files that have
+        not been accessed through a CacheManager use their modification-time
+        and a count of zero.
+        """
+
+        access = self._read_access()
+
+        # Include the accesses that have not been written yet.
+        with self._pending_lock:
+            pending = {k: dict(v) for k, v in self._pending.items()}
+        self._merge_access(access, pending)
+
+        entries = []
+        for entry in os.scandir(self.cache_dir):
+            # Skip hidden files such as the index- and access-files,
+            # and sub-directories which are not cache-files.
+            if entry.name.startswith('.') or not entry.is_file():
+                continue
+
+            stat = entry.stat()
+            record = access.get(entry.name, {})
+
+            entries.append({'file': entry.name,
+                            'bytes': stat.st_size,
+                            'accessed': record.get('accessed', stat.st_mtime),
+                            'count': record.get('count', 0)})
+
+        if self.policy == 'lfu':
+            entries.sort(key=lambda e: (e['count'], e['accessed']))
+        else:
+            entries.sort(key=lambda e: e['accessed'])
+
+        return entries
+
+    def total_bytes(self):
+        """
+        Return the total size of the cache-files in bytes.
+        """
+
+        return sum(entry['bytes'] for entry in self.entries())
+
+    def evict(self, max_bytes=None, keep=()):
+        """
+        Delete cache-files according to the eviction policy until
+        their total size is at most max_bytes.
+
+        :param max_bytes:
+            Maximum total size in bytes. If None then use self.max_bytes.
+
+        :param keep:
+            List of filenames that must not be deleted.
+
+        :return:
+            List of the deleted filenames.
+        """
+
+        if max_bytes is None:
+            max_bytes = self.max_bytes
+
+        if max_bytes is None:
+            return []
+
+        entries = self.entries()
+        total_bytes = sum(entry['bytes'] for entry in entries)
+
+        # Filenames to be deleted.
+        filenames = []
+
+        for entry in entries:
+            if total_bytes <= max_bytes:
+                break
+
+            if entry['file'] in keep:
+                continue
+
+            filenames.append(entry['file'])
+            total_bytes -= entry['bytes']
+
+        self._remove(filenames)
+
+        self.stats['evictions'] += len(filenames)
+
+        return filenames
+
+    def purge(self, filenames=None, older_than=None):
+        """
+        Delete cache-files from the cache-directory.
+
+        :param filenames:
+            List of filenames to delete. If None then all cache-files
+            are considered for deletion.
+
+        :param older_than:
+            If not None then only delete the cache-files that have not
+            been accessed for this number of seconds.
+
+        :return:
+            List of the deleted filenames.
+        """
+
+        now = time.time()
+
+        entries = self.entries()
+
+        if filenames is not None:
+            filenames = set(filenames)
+            entries = [entry for entry in entries if entry['file'] in filenames]
+
+        if older_than is not None:
+            entries = [entry for entry in entries
+                       if now - entry['accessed'] > older_than]
+
+        filenames = [entry['file'] for entry in entries]
+
+        self._remove(filenames)
+
+        return filenames
+
+    def _remove(self, filenames):
+        """
+        Delete the given cache-files and remove them from
+        the access-file and the index-file.
+        """
+
+        if len(filenames) == 0:
+            return
+
+        # Write the pending accesses first, so the access-file is
+        # only written once below.
+        self.flush()
+
+        for filename in filenames:
+            path = os.path.join(self.cache_dir, filename)
+
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            except OSError:
+                # E.g. on Windows a file cannot be deleted while it is
+                # memory-mapped, so it is kept until the next eviction.
+                print("- Could not delete cache-file: " + path)
+                continue
+
+            print("- Deleted cache-file: " + path)
+
+        filenames = set(filename for filename in filenames
+                        if not os.path.exists(os.path.join(self.cache_dir, filename)))
+
+        with self._lock(self._access_filename):
+            access = self._read_access()
+            access = {k: v for k, v in access.items() if k not in filenames}
+            self._write_access(access)
+
+        with self._lock(_index_filename):
+            index = _read_index(self.cache_dir)
+            index = {k: v for k, v in index.items() if v.get('file') not in filenames}
+            _write_index(self.cache_dir, index)
+
+
+def _entry_size(path):
+    """
+    Return the size of a cache-file in bytes, or zero if it does not exist.
+    """
+
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+
 ########################################################################
 
 
@@ -84,6 +2045,9 @@ def convert_numpy2pickle(in_path, out_path):
     Instead of re-calculating all the data, you can just convert the
     cache-file using this function.
 
+    Note that cache() can also use the numpy-format directly if the
+    filename ends with '.npy' or '.npz'.
+
     :param in_path:
         Input file in numpy-format written using numpy.save().
 
@@ -153,4 +2117,57 @@ if __name__ == '__main__':
 
     obj.print_result()
 
+    # Newline.
+    print()
+
+    # This is an example of content-addressed cache-files, where the
+    # filename is computed from the function and its arguments, so
+    # changing the arguments does not return stale data.
+    for b in [456, 789]:
+        result = cache_keyed(cache_dir='cache_keyed/',
+                             fn=expensive_function, kwargs={'a': 123, 'b': b})
+
+        print('result =', result)
+
+    # Newline.
+    print()
+
+    # This is an example of saving numpy arrays in numpy-format,
+    # so they are memory-mapped when they are reloaded.
+    def make_arrays(n):
+        return np.arange(n, dtype=np.float32), np.ones(shape=(n, 3))
+
+    x, y = cache(cache_path='cache_arrays.npz', fn=make_arrays, n=1000)
+
+    print('x.sum() =', x.sum(), ', y.shape =', y.shape)
+
+    # Newline.
+    print()
+
+    # This is an example of a cache-directory that is limited in size,
+    # so the least recently used cache-files are deleted automatically.
+    manager = CacheManager(cache_dir='cache_managed/', max_bytes=60000)
+
+    for n in [1000, 2000, 1000]:
+        x, y = manager.cache_keyed(fn=make_arrays, kwargs={'n': n},
+                                   backend='numpy')
+
+    print('stats =', manager.stats)
+    print('total_bytes =', manager.total_bytes())
+
+    # Newline.
+    print()
+
+    # This is an example of the decorator, where repeated calls in
+    # the same process return the result from memory, and the result
+    # is also saved to a cache-file for the next time.
+    @cached(dir='cache_decorated/', memory=True)
+    def expensive_product(a, b):
+        return a * b
+
+    for i in range(3):
+        print('result =', expensive_product(a=123, b=456))
+
+    print('cache_info =', expensive_product.cache_info())
+
 ########################################################################
@@ -9,16 +9,22 @@
 # 1) Set the variable data_path with the desired storage path.
 # 2) Call maybe_download_and_extract() to download the data-set
 #    if it is not already located in the given data_path.
+#    This also converts the data-set to a binary file that can be
+#    memory-mapped, so it is loaded much faster the next time.
 # 3) Call load_class_names() to get an array of the class-names.
 # 4) Call load_training_data() and load_test_data() to get
 #    the images, class-numbers and one-hot encoded class-labels
 #    for the training-set and test-set.
 # 5) Use the returned data in your own program.
+#    Or use batches() to iterate over random mini-batches for training.
 #
 # Format:
 # The images for the training- and test-sets are returned as 4-dim numpy
 # arrays each with the shape: [image_number, height, width, channel]
 # where the individual pixels are floats between 0.0 and 1.0.
+# Use the dtype-argument to get the pixels as float16 or float32 instead,
+# or as uint8 integers between 0 and 255 which is the original format
+# and only uses 1/8 of the memory.
 #
 ########################################################################
 #
@@ -35,8 +41,14 @@
 import numpy as np
 import pickle
 import os
+import json
+import queue
+import struct
+import threading
+import concurrent.futures
 from . import download
-from .dataset import one_hot_encoded
+from . import cache
+from .dataset import encode_labels
 
 ########################################################################
 
@@ -47,6 +59,9 @@ data_path = "data/CIFAR-10/"
 # URL for the data-set on the internet.
 data_url = "https://www.cs.toronto.edu/~kriz/cifar-10-python.tar.gz"
 
+# MD5-checksum of the file at data_url.
+data_md5 = "c58f30108f718f92721af3b95e74349a"
+
 ########################################################################
 # Various constants for the size of the images.
 # Use these constants in your own program.
@@ -76,6 +91,33 @@ _images_per_file = 10000
 # This is used to pre-allocate arrays for efficiency.
 _num_images_train = _num_files_train * _images_per_file
 
+########################################################################
+# The data-set is distributed as pickled Python objects, which are slow
+# to load. It is therefore converted once to a binary file with a fixed
+# layout, which is then memory-mapped when the data is loaded:
+#
+#   header | class-names | images_train | cls_train | images_test | cls_test
+#
+# The header holds the sizes and byte-offsets of the sections. The
+# class-names are a JSON-list. The images are uint8-arrays with shape
+# [image_number, height, width, channel] and the class-numbers are
+# int64-arrays. All arrays are aligned to 64 bytes.
+
+# Filename for the binary file in data_path.
+_binary_filename = "cifar-10.bin"
+
+# Magic string and version for the binary file.
+_binary_magic = b'CIFAR10B'
+_binary_version = 1
+
+# Header for the binary file: magic, version, num_images_train,
+# num_images_test, img_size, num_channels, num_classes, len(class-names),
+# and the offsets for images_train, cls_train, images_test, cls_test.
+_binary_header = struct.Struct('<8sIIIIIII4Q')
+
+# Alignment of the arrays in the binary file.
+_binary_alignment = 64
+
 ########################################################################
 # Private functions for downloading, unpacking and loading data-files.
 
@@ -110,30 +152,77 @@ def _unpickle(filename):
     return data
 
 
-def _convert_images(raw):
+# Data-types that can be used for the images.
+_image_dtypes = (np.uint8, np.float16, np.float32, np.float64)
+
+
+def _check_dtype(dtype):
+    """
+    Return the dtype as a numpy dtype-object,
+    or raise ValueError if it cannot be used for the images.
+    """
+
+    dtype = np.dtype(dtype)
+
+    if dtype not in _image_dtypes:
+        raise ValueError("Invalid dtype for the images: " + str(dtype))
+
+    return dtype
+
+
+def _convert_images(raw, dtype=float, out=None):
     """
     Convert images from the CIFAR-10 format and
     return a 4-dim array with shape: [image_number, height, width, channel]
-    where the pixels are floats between 0.0 and 1.0.
+    where the pixels are floats between 0.0 and 1.0,
+    or integers between 0 and 255 if dtype is uint8.
+
+    If out is given then the images are written directly into that array,
+    which must have the correct shape and dtype. Otherwise a new array is
+    allocated. No temporary arrays are created in either case.
     """
 
-    # Convert the raw images from the data-files to floating-points.
-    raw_float = np.array(raw, dtype=float) / 255.0
+    # The raw images are bytes so view them as uint8 without copying.
+    raw = np.asarray(raw, dtype=np.uint8)
 
     # Reshape the array to 4-dimensions.
-    images = raw_float.reshape([-1, num_channels, img_size, img_size])
+    images = raw.reshape([-1, num_channels, img_size, img_size])
 
-    # Reorder the indices of the array.
+    # Reorder the indices of the array. This is only a view.
     images = images.transpose([0, 2, 3, 1])
 
-    return images
+    return _scale_images(images, dtype=dtype, out=out)
+
+
+def _scale_images(images, dtype=float, out=None):
+    """
+    Convert uint8-images with shape [image_number, height, width, channel]
+    to the given dtype, see _convert_images().
+    """
+
+    dtype = _check_dtype(dtype)
+
+    if out is None:
+        out = np.empty(shape=images.shape, dtype=dtype)
+
+    if dtype == np.uint8:
+        # Copy the pixels into the output in the new order.
+        out[...] = images
+    else:
+        # Convert the pixels to floating-points between 0.0 and 1.0
+        # while writing them into the output.
+        np.divide(images, 255.0, out=out, dtype=dtype)
+
+    return out
 
 
-def _load_data(filename):
+def _load_data(filename, dtype=float, out=None):
     """
     Load a pickled data-file from the CIFAR-10 data-set
     and return the converted images (see above) and the class-number
     for each image.
+
+    If out is given then the images are written directly into that array.
     """
 
     # Load the pickled data-file.
@@ -146,23 +235,164 @@ def _load_data(filename):
     cls = np.array(data[b'labels'])
 
     # Convert the images.
-    images = _convert_images(raw_images)
+    images = _convert_images(raw_images, dtype=dtype, out=out)
 
     return images, cls
 
 
+def _from_binary(images, dtype):
+    """
+    Return the memory-mapped uint8-images from the binary file
+    converted to the given dtype, or the images themselves if
+    dtype is uint8.
+    """
+
+    if dtype == np.uint8:
+        return images
+    else:
+        return _scale_images(images, dtype=dtype)
+
+
+def _get_binary_path():
+    """
+    Return the full path of the binary file for the data-set.
+    """
+
+    return os.path.join(data_path, _binary_filename)
+
+
+def _align(offset):
+    """
+    Round the offset up to the alignment of the arrays in the binary file.
+    """
+
+    return -(-offset // _binary_alignment) * _binary_alignment
+
+
+def _convert_to_binary():
+    """
+    Load the pickled data-files and save them in the binary file.
+    """
+
+    # Load all the data in the original uint8-format.
+    names = load_class_names()
+    images_train, cls_train, _ = load_training_data(dtype=np.uint8, one_hot=None)
+    images_test, cls_test, _ = load_test_data(dtype=np.uint8, one_hot=None)
+
+    arrays = [np.ascontiguousarray(images_train),
+              np.ascontiguousarray(cls_train, dtype='<i8'),
+              np.ascontiguousarray(images_test),
+              np.ascontiguousarray(cls_test, dtype='<i8')]
+
+    names = json.dumps(names).encode('utf-8')
+
+    # Byte-offsets for the arrays.
+    offsets = []
+    end = _binary_header.size + len(names)
+    for arr in arrays:
+        offset = _align(end)
+        offsets.append(offset)
+        end = offset + arr.nbytes
+
+    header = _binary_header.pack(_binary_magic, _binary_version,
+                                 len(images_train), len(images_test),
+                                 img_size, num_channels, num_classes,
+                                 len(names), *offsets)
+
+    path = _get_binary_path()
+
+    print("Converting data-set to binary file: " + path)
+
+    def write(file):
+        file.write(header)
+        file.write(names)
+
+        pos = _binary_header.size + len(names)
+        for offset, arr in zip(offsets, arrays):
+            file.write(b'\x00' * (offset - pos))
+            file.write(arr.data)
+            pos = offset + arr.nbytes
+
+    # Write to a temporary file with a unique name which is renamed when
+    # it is complete, so a half-written binary file is never used, even
+    # if several processes convert the data-set at the same time.
+    cache._atomic_write(path, write)
+
+
+def _load_binary():
+    """
+    Memory-map the binary file for the data-set.
+
+    Returns a dict with the class-names and read-only arrays for the
+    images and class-numbers, or None if the binary file does not exist.
+    """
+
+    path = _get_binary_path()
+
+    if not os.path.exists(path):
+        return None
+
+    with open(path, mode='rb') as file:
+        header = _binary_header.unpack(file.read(_binary_header.size))
+
+        magic, version, num_train, num_test, size, channels, classes, len_names = header[:8]
+        offsets = header[8:]
+
+        if magic != _binary_magic or version != _binary_version:
+            return None
+
+        names = json.loads(file.read(len_names).decode('utf-8'))
+
+    shape_train = (num_train, size, size, channels)
+    shape_test = (num_test, size, size, channels)
+
+    return {'class_names': names,
+            'images_train': np.memmap(path, mode='r', dtype=np.uint8,
+                                      shape=shape_train, offset=offsets[0]),
+            'cls_train': np.memmap(path, mode='r', dtype='<i8',
+                                   shape=(num_train,), offset=offsets[1]),
+            'images_test': np.memmap(path, mode='r', dtype=np.uint8,
+                                     shape=shape_test, offset=offsets[2]),
+            'cls_test': np.memmap(path, mode='r', dtype='<i8',
+                                  shape=(num_test,), offset=offsets[3])}
+
+
 ########################################################################
 # Public functions that you may call to download the data-set from
 # the internet and load the data into memory.
 
 
-def maybe_download_and_extract():
+def maybe_download_and_extract(convert=True):
     """
     Download and extract the CIFAR-10 data-set if it doesn't already exist
     in data_path (set this variable first to the desired path).
+
+    :param convert:
+        Boolean whether to also convert the data-set to a binary file
+        if it doesn't already exist, see maybe_convert_to_binary().
     """
 
-    download.maybe_download_and_extract(url=data_url, download_dir=data_path)
+    download.maybe_download_and_extract(url=data_url, download_dir=data_path,
+                                        checksum=data_md5, hash_name='md5')
+
+    if convert:
+        maybe_convert_to_binary()
+
+
+def maybe_convert_to_binary():
+    """
+    Convert the pickled data-files to a binary file in data_path
+    if it doesn't already exist. When the binary file exists, the
+    load-functions memory-map it instead of loading the pickled files,
+    so the images are available in milliseconds.
+
+    Delete the binary file to go back to loading the pickled files.
+    """
+
+    if _load_binary() is None:
+        _convert_to_binary()
+    else:
+        print("Data has apparently already been converted to a binary file.")
 
 
 def load_class_names():
@@ -173,6 +403,11 @@ def load_class_names():
     associated with class-number 3.
     """
 
+    # Use the binary file if it exists.
+    binary = _load_binary()
+    if binary is not None:
+        return binary['class_names']
+
     # Load the class-names from the pickled file.
     raw = _unpickle(filename="batches.meta")[b'label_names']
 
@@ -182,54 +417,274 @@ def load_class_names():
     return names
 
 
-def load_training_data():
+def load_training_data(dtype=float, num_workers=None, one_hot='dense', one_hot_dtype=float):
     """
     Load all the training-data for the CIFAR-10 data-set.
 
     The data-set is split into 5 data-files which are merged here.
+    The data-files are loaded in parallel using a thread-pool, where
+    each thread writes directly into its own part of the arrays.
+
+    :param dtype:
+        Data-type for the images: float (default), np.float32 or
+        np.float16 for pixels between 0.0 and 1.0, or np.uint8 for
+        the original pixels between 0 and 255.
+
+    :param num_workers:
+        Number of threads for loading the data-files.
+        If None then use one thread per data-file, limited by the
+        number of CPU cores. Use 1 to load the data-files sequentially.
+
+    :param one_hot:
+        Format of the one-hot encoded class-labels: 'dense', 'sparse'
+        or None, see dataset.encode_labels().
+
+    :param one_hot_dtype:
+        Data-type for the one-hot encoded class-labels,
+        e.g. np.uint8 or bool to save memory.
+
+    If the binary file exists (see maybe_convert_to_binary()) then the
+    arrays are memory-mapped from it instead. The images are then returned
+    as a read-only view if dtype is uint8, and the class-numbers are
+    always returned as a read-only view.
 
     Returns the images, class-numbers and one-hot encoded class-labels.
     """
 
-    # Pre-allocate the arrays for the images and class-numbers for efficiency.
-    images = np.zeros(shape=[_num_images_train, img_size, img_size, num_channels], dtype=float)
-    cls = np.zeros(shape=[_num_images_train], dtype=int)
+    dtype = _check_dtype(dtype)
 
-    # Begin-index for the current batch.
-    begin = 0
+    # Use the binary file if it exists.
+    binary = _load_binary()
+    if binary is not None:
+        images = _from_binary(binary['images_train'], dtype=dtype)
+        cls = binary['cls_train']
 
-    # For each data-file.
-    for i in range(_num_files_train):
-        # Load the images and class-numbers from the data-file.
-        images_batch, cls_batch = _load_data(filename="data_batch_" + str(i + 1))
+        return images, cls, encode_labels(class_numbers=cls, num_classes=num_classes,
+                                          one_hot=one_hot, dtype=one_hot_dtype)
 
-        # Number of images in this batch.
-        num_images = len(images_batch)
+    # Pre-allocate the arrays for the images and class-numbers for efficiency.
+    # The arrays are filled completely below so they need not be zeroed.
+    images = np.empty(shape=[_num_images_train, img_size, img_size, num_channels], dtype=dtype)
+    cls = np.zeros(shape=[_num_images_train], dtype=int)
 
-        # End-index for the current batch.
-        end = begin + num_images
+    def load_batch(i):
+        # Begin- and end-index for this batch.
+        begin = i * _images_per_file
+        end = begin + _images_per_file
 
-        # Store the images into the array.
-        images[begin:end, :] = images_batch
+        # Load the images and class-numbers from the data-file.
+        # The images are written directly into the array.
+        _, cls_batch = _load_data(filename="data_batch_" + str(i + 1),
+                                  dtype=dtype, out=images[begin:end])
 
         # Store the class-numbers into the array.
         cls[begin:end] = cls_batch
 
-        # The begin-index for the next batch is the current end-index.
-        begin = end
+    if num_workers is None:
+        num_workers = min(_num_files_train, os.cpu_count() or 1)
+
+    if num_workers <= 1:
+        # Load the data-files one after the other.
+        for i in range(_num_files_train):
+            load_batch(i)
+    else:
+        # Load the data-files in parallel. Reading the files and converting
+        # the images release the GIL so this scales with the CPU cores.
+        with concurrent.futures.ThreadPoolExecutor(max_workers=num_workers) as executor:
+            # Use list() to raise any exceptions from the threads.
+            list(executor.map(load_batch, range(_num_files_train)))
 
-    return images, cls, one_hot_encoded(class_numbers=cls, num_classes=num_classes)
+    return images, cls, encode_labels(class_numbers=cls, num_classes=num_classes,
+                                      one_hot=one_hot, dtype=one_hot_dtype)
 
 
-def load_test_data():
+def load_test_data(dtype=float, one_hot='dense', one_hot_dtype=float):
     """
     Load all the test-data for the CIFAR-10 data-set.
 
+    :param dtype:
+        Data-type for the images, see load_training_data().
+
+    :param one_hot:
+        Format of the one-hot encoded class-labels, see load_training_data().
+
+    :param one_hot_dtype:
+        Data-type for the one-hot encoded class-labels.
+
     Returns the images, class-numbers and one-hot encoded class-labels.
     """
 
-    images, cls = _load_data(filename="test_batch")
+    dtype = _check_dtype(dtype)
+
+    # Use the binary file if it exists.
+    binary = _load_binary()
+    if binary is not None:
+        images = _from_binary(binary['images_test'], dtype=dtype)
+        cls = binary['cls_test']
+    else:
+        images, cls = _load_data(filename="test_batch", dtype=dtype)
+
+    return images, cls, encode_labels(class_numbers=cls, num_classes=num_classes,
+                                      one_hot=one_hot, dtype=one_hot_dtype)
+
+
+def batches(batch_size, shuffle=True, seed=None, epochs=1, dtype=float,
+            test=False, drop_last=False):
+    """
+    Generator for mini-batches of the CIFAR-10 data-set.
+
+    The images are kept in their original uint8-format (memory-mapped if
+    the binary file exists, see maybe_convert_to_binary()) and only the
+    images of each batch are gathered and converted to the given dtype.
+    The next batch is prepared in a background thread while the current
+    batch is being used, so the training-loop does not have to wait.
+
+    The batches are written into two pre-allocated buffers that are reused,
+    so the arrays of a batch are only valid until the next batch is
+    requested. Copy them if they are needed for longer.
+
+    Example:
+
+        for images, cls in batches(batch_size=64, seed=42, epochs=10):
+            ...
+
+    :param batch_size:
+        Number of images in each batch.
+
+    :param shuffle:
+        Boolean whether to shuffle the images in each epoch.
+
+    :param seed:
+        Seed for the random shuffling, so the batches can be reproduced.
+
+    :param epochs:
+        Number of passes over the data-set. If None then loop forever.
+
+    :param dtype:
+        Data-type for the images, see load_training_data().
+
+    :param test:
+        Boolean whether to use the test-set (True) or training-set (False).
+
+    :param drop_last:
+        Boolean whether to skip the last batch of each epoch
+        if it has less than batch_size images.
+
+    :return:
+        Generator that yields the images and class-numbers for each batch.
+    """
+
+    dtype = _check_dtype(dtype)
+
+    # Load the data-set in its original compact format.
+    if test:
+        images, cls, _ = load_test_data(dtype=np.uint8, one_hot=None)
+    else:
+        images, cls, _ = load_training_data(dtype=np.uint8, one_hot=None)
+
+    num_images = len(images)
+
+    # Random number generator for the shuffling.
+    rng = np.random.RandomState(seed)
+
+    def index_batches():
+        # Generator for the indices of the images in each batch.
+        epoch = 0
+        while epochs is None or epoch < epochs:
+            if shuffle:
+                idx = rng.permutation(num_images)
+            else:
+                idx = np.arange(num_images)
+
+            for begin in range(0, num_images, batch_size):
+                idx_batch = idx[begin:begin + batch_size]
+
+                if drop_last and len(idx_batch) < batch_size:
+                    break
+
+                yield idx_batch
+
+            epoch += 1
+
+    # Two buffers for the batches: one is used by the training-loop
+    # while the other is being filled by the background thread.
+    num_buffers = 2
+    buffers = []
+    for _ in range(num_buffers):
+        images_buffer = np.empty(shape=(batch_size,) + images.shape[1:], dtype=dtype)
+        cls_buffer = np.empty(shape=(batch_size,), dtype=cls.dtype)
+
+        # Buffer for gathering the uint8-images before they are converted.
+        if dtype == np.uint8:
+            gather_buffer = images_buffer
+        else:
+            gather_buffer = np.empty(shape=images_buffer.shape, dtype=np.uint8)
+
+        buffers.append((images_buffer, cls_buffer, gather_buffer))
+
+    # Queue with the numbers of the buffers that can be filled.
+    free = queue.Queue()
+    for i in range(num_buffers):
+        free.put(i)
+
+    # Queue with the filled buffers and their number of images.
+    ready = queue.Queue()
+
+    # Marker for the end of the batches.
+    done = object()
+
+    def produce():
+        # Fill the buffers in the background thread.
+        try:
+            for idx_batch in index_batches():
+                i = free.get()
+
+                # The generator has been closed.
+                if i is None:
+                    return
+
+                images_buffer, cls_buffer, gather_buffer = buffers[i]
+                n = len(idx_batch)
+
+                np.take(images, idx_batch, axis=0, out=gather_buffer[:n])
+                np.take(cls, idx_batch, axis=0, out=cls_buffer[:n])
+
+                if gather_buffer is not images_buffer:
+                    _scale_images(gather_buffer[:n], dtype=dtype, out=images_buffer[:n])
+
+                ready.put((i, n))
+
+            ready.put(done)
+        except BaseException as e:
+            # Pass the exception to the training-loop.
+            ready.put(e)
+
+    thread = threading.Thread(target=produce, daemon=True)
+    thread.start()
+
+    # Number of the buffer that is used by the training-loop.
+    current = None
+
+    try:
+        while True:
+            item = ready.get()
+
+            # The previous batch is no longer used so its buffer can be filled.
+            if current is not None:
+                free.put(current)
+                current = None
+
+            if item is done:
+                break
+            elif isinstance(item, BaseException):
+                raise item
+
+            current, n = item
+            images_buffer, cls_buffer, _ = buffers[current]
 
-    return images, cls, one_hot_encoded(class_numbers=cls, num_classes=num_classes)
+            yield images_buffer[:n], cls_buffer[:n]
+    finally:
+        # Stop the background thread if it is waiting for a buffer.
+        free.put(None)
 
 ########################################################################
@@ -20,12 +20,14 @@
 
 import numpy as np
 import os
-from .cache import cache
+import time
+import concurrent.futures
+from .cache import cache, cache_in_memory, update_cache
 
 ########################################################################
 
 
-def one_hot_encoded(class_numbers, num_classes=None):
+def one_hot_encoded(class_numbers, num_classes=None, dtype=float, sparse=False):
     """
     Generate the One-Hot encoded class-labels from an array of integers.
 
@@ -39,23 +41,233 @@ def one_hot_encoded(class_numbers, num_classes=None):
     :param num_classes:
         Number of classes. If None then use max(class_numbers)+1.
 
+    :param dtype:
+        Data-type for the labels. Use e.g. np.uint8 or bool to save memory.
+
+    :param sparse:
+        Boolean whether to return a scipy.sparse CSR-matrix which only
+        stores the ones. This uses much less memory when there are many
+        classes.
+
     :return:
         2-dim array of shape: [len(class_numbers), num_classes]
     """
 
+    class_numbers = np.asarray(class_numbers, dtype=np.intp)
+
     # Find the number of classes if None is provided.
     # Assumes the lowest class-number is zero.
     if num_classes is None:
-        num_classes = np.max(class_numbers) + 1
+        num_classes = np.max(class_numbers) + 1 if class_numbers.size > 0 else 0
+
+    num_labels = len(class_numbers)
+
+    if sparse:
+        import scipy.sparse
+
+        # Each row has a single one in the column of its class-number.
+        data = np.ones(num_labels, dtype=dtype)
+        indptr = np.arange(num_labels + 1)
+
+        return scipy.sparse.csr_matrix((data, class_numbers, indptr),
+                                       shape=(num_labels, num_classes))
+
+    # Set the ones directly in an array of zeros.
+    labels = np.zeros(shape=(num_labels, num_classes), dtype=dtype)
+    labels[np.arange(num_labels), class_numbers] = 1
+
+    return labels
+
+
+# Valid values for the one_hot-argument of encode_labels().
+one_hot_modes = ('dense', 'sparse', None)
+
+
+def encode_labels(class_numbers, num_classes, one_hot='dense', dtype=float):
+    """
+    Return the class-labels in the given format.
+
+    :param class_numbers:
+        Array of integers with class-numbers.
+
+    :param num_classes:
+        Number of classes.
+
+    :param one_hot:
+        'dense' for a numpy array with the one-hot encoded labels,
+        'sparse' for a scipy.sparse CSR-matrix with the one-hot encoded
+        labels, or None to skip the one-hot encoding and return None,
+        so only the integer class-numbers are used.
+
+    :param dtype:
+        Data-type for the one-hot encoded labels.
+
+    :return:
+        The class-labels, or None.
+    """
+
+    if one_hot not in one_hot_modes:
+        raise ValueError("Invalid one_hot: " + str(one_hot))
+
+    if one_hot is None:
+        return None
+
+    return one_hot_encoded(class_numbers=class_numbers, num_classes=num_classes,
+                           dtype=dtype, sparse=(one_hot == 'sparse'))
+
+
+# Coarsest resolution of the modification-times on the file-systems that
+# are supported, in nanoseconds. FAT only has a resolution of 2 seconds.
+_mtime_resolution = 2 * 10 ** 9
 
-    return np.eye(num_classes, dtype=float)[class_numbers]
+
+def _is_racy(mtime):
+    """
+    Return True if a modification-time is so recent that the directory
+    could still be changed without its modification-time changing,
+    because of the coarse resolution of the file-system.
+
+    This must be called after the directory has been listed, and a racy
+    modification-time must not be saved, so the directory is rescanned
+    by the next refresh() instead of missing files that were added in the
+    same clock-tick. This is the same approach as 'racy git'.
+    """
+
+    return mtime is not None and mtime > time.time() * 1e9 - _mtime_resolution
+
+
+def _get_mtime(path):
+    """
+    Return the modification-time of a file or directory in nanoseconds,
+    or None if it does not exist.
+    """
+
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+
+########################################################################
+
+
+class StringArray:
+    def __init__(self, strings=()):
+        """
+        Compact list of strings, which are stored in a single packed
+        byte-buffer with an array of offsets, instead of a Python list of
+        str-objects. This uses much less memory for millions of strings
+        and is much faster to pickle.
+
+        It supports len(), iteration, indexing with an integer, a slice
+        or an array of integers or booleans, and extend(). The strings are encoded
+        using UTF-8 with 'surrogateescape' so all filenames are supported.
+
+        :param strings:
+            Initial strings.
+
+        :return:
+            Object instance.
+        """
+
+        # Packed bytes for all the strings.
+        self._data = b''
+
+        # Byte-offsets for the beginning and end of each string.
+        self._offsets = np.zeros(1, dtype=np.int64)
+
+        self.extend(strings)
+
+    def extend(self, strings):
+        """
+        Append the strings to the end of the array.
+        """
+
+        encoded = [s.encode('utf-8', 'surrogateescape') for s in strings]
+
+        if len(encoded) == 0:
+            return
+
+        lengths = np.fromiter((len(b) for b in encoded), dtype=np.int64, count=len(encoded))
+        ends = self._offsets[-1] + np.cumsum(lengths)
+
+        self._offsets = np.concatenate([self._offsets, ends])
+        self._data = self._data + b''.join(encoded)
+
+    def _get(self, i):
+        begin, end = self._offsets[i], self._offsets[i + 1]
+
+        return self._data[begin:end].decode('utf-8', 'surrogateescape')
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self._get(i) for i in range(*index.indices(len(self)))]
+
+        if isinstance(index, (int, np.integer)):
+            if index < 0:
+                index += len(self)
+            if not 0 <= index < len(self):
+                raise IndexError("StringArray index out of range")
+
+            return self._get(index)
+
+        index = np.asarray(index)
+
+        # Boolean mask with the same length as this array.
+        if index.dtype == bool:
+            if index.shape != (len(self),):
+                raise IndexError("StringArray boolean index has wrong length")
+
+            index = np.flatnonzero(index)
+
+        # Empty lists are converted to float-arrays by numpy.
+        if index.size == 0:
+            return []
+
+        if not np.issubdtype(index.dtype, np.integer):
+            raise TypeError("StringArray indices must be integers, slices, "
+                            "or arrays of integers or booleans, "
+                            "not " + str(index.dtype))
+
+        # Array of indices.
+        return [self[i] for i in index.ravel()]
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self._get(i)
+
+    def __eq__(self, other):
+        if isinstance(other, StringArray):
+            return (np.array_equal(self._offsets, other._offsets)
+                    and self._data == other._data)
+
+        # Let Python try other.__eq__ if it is not a sequence of strings.
+        try:
+            other = list(other)
+        except TypeError:
+            return NotImplemented
+
+        return list(self) == other
+
+    def __repr__(self):
+        return 'StringArray(' + repr(list(self)) + ')'
+
+    def tolist(self):
+        """
+        Return the strings as a Python list.
+        """
+
+        return list(self)
 
 
 ########################################################################
 
 
 class DataSet:
-    def __init__(self, in_dir, exts='.jpg'):
+    def __init__(self, in_dir, exts='.jpg', num_workers=None):
         """
         Create a data-set consisting of the filenames in the given directory
         and sub-dirs that match the given filename-extensions.
@@ -100,6 +312,11 @@ class DataSet:
             String or tuple of strings with valid filename-extensions.
             Not case-sensitive.
 
+        :param num_workers:
+            Number of threads used for scanning the class-directories
+            in parallel, which is much faster on network file-systems.
+            If None then use a default number of threads.
+
         :return:
             Object instance.
         """
@@ -117,63 +334,197 @@ class DataSet:
         self.class_names = []
 
         # Filenames for all the files in the training-set.
-        self.filenames = []
+        # These are stored compactly in a StringArray.
+        self.filenames = StringArray()
 
         # Filenames for all the files in the test-set.
-        self.filenames_test = []
+        self.filenames_test = StringArray()
 
         # Class-number for each file in the training-set.
-        self.class_numbers = []
+        self.class_numbers = np.zeros(0, dtype=np.int32)
 
         # Class-number for each file in the test-set.
-        self.class_numbers_test = []
+        self.class_numbers_test = np.zeros(0, dtype=np.int32)
 
         # Total number of classes in the data-set.
         self.num_classes = 0
 
-        # For all files/dirs in the input directory.
-        for name in os.listdir(in_dir):
-            # Full path for the file / dir.
-            current_dir = os.path.join(in_dir, name)
+        # Modification-times for the directories that have been scanned,
+        # which are used by refresh() to only rescan changed directories.
+        self._mtimes = {}
+
+        # Scan all the directories for the files in the data-set.
+        self.refresh(num_workers=num_workers)
+
+    def refresh(self, num_workers=None):
+        """
+        Rescan the directories for the data-set and add new classes and files.
+
+        Only the directories whose modification-time has changed since they
+        were last scanned are listed again, so this is very fast if nothing
+        has changed. The class-numbers and the order of the existing files
+        never change, so e.g. Transfer Values that were saved for the files
+        remain valid. New classes and files are appended at the end.
+
+        Files and classes that have been deleted are NOT removed from the
+        data-set, because that would change the order of the files.
+
+        This is also used by __init__() for the first scan, where all the
+        directories are new.
+
+        :param num_workers:
+            Number of threads used for scanning the class-directories
+            in parallel, which is much faster on network file-systems.
+            If None then use a default number of threads.
+
+        :return:
+            Number of new files in the training- and test-sets.
+        """
+
+        # DataSet-objects saved before refresh() existed have no mtimes,
+        # so all their directories are rescanned.
+        if not hasattr(self, '_mtimes'):
+            self._mtimes = {}
+
+        # DataSet-objects saved before StringArray existed use lists.
+        self._convert_lists()
+
+        # If the input directory has changed then look for new classes.
+        mtime = _get_mtime(self.in_dir)
+        if mtime is None or mtime != self._mtimes.get(''):
+            # Names of all the sub-dirs in the input directory, which are the
+            # class-names. The directory-entries from os.scandir() already know
+            # whether they are directories, so no extra system-calls are needed.
+            with os.scandir(self.in_dir) as entries:
+                class_names = [entry.name for entry in entries if entry.is_dir()]
+
+            for name in class_names:
+                if name not in self.class_names:
+                    # Add the dir-name to the list of class-names.
+                    self.class_names.append(name)
+
+                    # Increase the total number of classes in the data-set.
+                    self.num_classes += 1
+
+            # Rescan the input directory next time if its mtime is racy.
+            self._mtimes[''] = None if _is_racy(mtime) else mtime
+
+        # Relative paths for the directories of the training- and test-sets
+        # for all the classes, which are used as keys for the mtimes.
+        rel_dirs = []
+        for name in self.class_names:
+            rel_dirs.append(name)
+            rel_dirs.append(os.path.join(name, 'test'))
+
+        # Scan the directories in parallel.
+        # The results are in the same order as the directories.
+        if num_workers is None:
+            num_workers = min(32, 4 * (os.cpu_count() or 1))
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=num_workers) as executor:
+            scanned = list(executor.map(self._scan_if_changed, rel_dirs))
+
+        # New filenames and class-numbers for the training-set and test-set.
+        # They are appended to the data-set at the end, so the arrays
+        # are only copied once no matter how many directories changed.
+        new_names = ([], [])
+        new_classes = ([], [])
+
+        for i, (rel_dir, (mtime, filenames)) in enumerate(zip(rel_dirs, scanned)):
+            self._mtimes[rel_dir] = mtime
+
+            # The directory has not changed.
+            if filenames is None:
+                continue
+
+            # The class-number and whether it is the test-set.
+            class_number, test = divmod(i, 2)
+
+            # Set with the known filenames for only this class and set.
+            known_set = self._known_filenames(class_number, test=test)
+
+            # Only the new filenames, in the order they were scanned.
+            new_filenames = [filename for filename in filenames
+                             if filename not in known_set]
+
+            new_names[test].extend(new_filenames)
+            new_classes[test].append(np.full(len(new_filenames), class_number, dtype=np.int32))
+
+        # Append the new files to the arrays for the training-set.
+        if len(new_names[0]) > 0:
+            self.filenames.extend(new_names[0])
+            self.class_numbers = np.concatenate([self.class_numbers] + new_classes[0])
+
+        # Append the new files to the arrays for the test-set.
+        if len(new_names[1]) > 0:
+            self.filenames_test.extend(new_names[1])
+            self.class_numbers_test = np.concatenate([self.class_numbers_test] + new_classes[1])
+
+        # Number of new files.
+        num_new = len(new_names[0]) + len(new_names[1])
+
+        return num_new
+
+    def _convert_lists(self):
+        """
+        Convert the lists of filenames and class-numbers to the compact
+        storage, if this DataSet-object was saved with lists in an older
+        version of this class.
+        """
+
+        if not isinstance(self.filenames, StringArray):
+            self.filenames = StringArray(self.filenames)
+            self.filenames_test = StringArray(self.filenames_test)
+            self.class_numbers = np.asarray(self.class_numbers, dtype=np.int32)
+            self.class_numbers_test = np.asarray(self.class_numbers_test, dtype=np.int32)
 
-            # If it is a directory.
-            if os.path.isdir(current_dir):
-                # Add the dir-name to the list of class-names.
-                self.class_names.append(name)
+    def __setstate__(self, state):
+        # Called when the DataSet-object is unpickled.
+        self.__dict__.update(state)
+        self._convert_lists()
 
-                # Training-set.
+    def _scan_if_changed(self, rel_dir):
+        """
+        Scan a directory of the data-set if it has changed.
 
-                # Get all the valid filenames in the dir (not sub-dirs).
-                filenames = self._get_filenames(current_dir)
+        :param rel_dir:
+            Directory relative to self.in_dir.
 
-                # Append them to the list of all filenames for the training-set.
-                self.filenames.extend(filenames)
+        :return:
+            The modification-time of the directory or None if it is racy,
+            and the list of filenames or None if the directory has not changed.
+        """
 
-                # The class-number for this class.
-                class_number = self.num_classes
+        dir = os.path.join(self.in_dir, rel_dir)
 
-                # Create an array of class-numbers.
-                class_numbers = [class_number] * len(filenames)
+        # Get the mtime before listing the directory, so a change made
+        # while it is being listed is found by the next refresh().
+        mtime = _get_mtime(dir)
 
-                # Append them to the list of all class-numbers for the training-set.
-                self.class_numbers.extend(class_numbers)
+        if mtime is not None and mtime == self._mtimes.get(rel_dir):
+            return mtime, None
 
-                # Test-set.
+        filenames = self._get_filenames(dir)
 
-                # Get all the valid filenames in the sub-dir named 'test'.
-                filenames_test = self._get_filenames(os.path.join(current_dir, 'test'))
+        # Don't save a racy mtime, so the directory is rescanned next time.
+        if _is_racy(mtime):
+            mtime = None
 
-                # Append them to the list of all filenames for the test-set.
-                self.filenames_test.extend(filenames_test)
+        return mtime, filenames
 
-                # Create an array of class-numbers.
-                class_numbers = [class_number] * len(filenames_test)
+    def _known_filenames(self, class_number, test=False):
+        """
+        Return a set with the filenames of the given class in either
+        the training-set or test-set. Only the filenames of that class
+        are decoded, so this is fast even for a very large data-set.
+        """
 
-                # Append them to the list of all class-numbers for the test-set.
-                self.class_numbers_test.extend(class_numbers)
+        if test:
+            filenames, class_numbers = self.filenames_test, self.class_numbers_test
+        else:
+            filenames, class_numbers = self.filenames, self.class_numbers
 
-                # Increase the total number of classes in the data-set.
-                self.num_classes += 1
+        return set(filenames[np.flatnonzero(class_numbers == class_number)])
 
     def _get_filenames(self, dir):
         """
@@ -189,22 +540,32 @@ class DataSet:
         # Initialize empty list.
         filenames = []
 
-        # If the directory exists.
-        if os.path.exists(dir):
-            # Get all the filenames with matching extensions.
-            for filename in os.listdir(dir):
-                if filename.lower().endswith(self.exts):
-                    filenames.append(filename)
+        # Get all the filenames with matching extensions.
+        # If the directory does not exist then the list is empty.
+        try:
+            with os.scandir(dir) as entries:
+                for entry in entries:
+                    if entry.name.lower().endswith(self.exts):
+                        filenames.append(entry.name)
+        except (FileNotFoundError, NotADirectoryError):
+            pass
 
         return filenames
 
-    def get_paths(self, test=False):
+    def get_paths(self, test=False, indices=None):
         """
         Get the full paths for the files in the data-set.
 
+        The paths are created lazily while iterating, so all the paths
+        are never held in memory unless they are put in a list.
+
         :param test:
             Boolean. Return the paths for the test-set (True) or training-set (False).
 
+        :param indices:
+            Optional array of integers with the indices of the files.
+            If None then get the paths for all the files.
+
         :return:
             Iterator with strings for the path-names.
         """
@@ -224,41 +585,187 @@ class DataSet:
             # Don't use a sub-dir for test-set.
             test_dir = ""
 
-        for filename, cls in zip(filenames, class_numbers):
+        # The directory for each class, which is the same for many files,
+        # so it is only joined once. It ends with a path-separator.
+        class_dirs = [os.path.join(self.in_dir, class_name, test_dir)
+                      for class_name in self.class_names]
+
+        if indices is None:
+            indices = range(len(filenames))
+
+        for i in indices:
             # Full path-name for the file.
-            path = os.path.join(self.in_dir, self.class_names[cls], test_dir, filename)
+            path = class_dirs[class_numbers[i]] + filenames[i]
 
             yield path
 
-    def get_training_set(self):
+    def get_training_set(self, one_hot='dense', one_hot_dtype=float):
         """
         Return the list of paths for the files in the training-set,
         and the list of class-numbers as integers,
         and the class-numbers as one-hot encoded arrays.
+
+        :param one_hot:
+            Format of the one-hot encoded labels, see encode_labels().
+            Use None to only get the integer class-numbers.
+
+        :param one_hot_dtype:
+            Data-type for the one-hot encoded labels.
         """
 
         return list(self.get_paths()), \
-               np.asarray(self.class_numbers), \
-               one_hot_encoded(class_numbers=self.class_numbers,
-                               num_classes=self.num_classes)
+               np.asarray(self.class_numbers, dtype=int), \
+               encode_labels(class_numbers=self.class_numbers,
+                             num_classes=self.num_classes,
+                             one_hot=one_hot, dtype=one_hot_dtype)
 
-    def get_test_set(self):
+    def get_test_set(self, one_hot='dense', one_hot_dtype=float):
         """
         Return the list of paths for the files in the test-set,
         and the list of class-numbers as integers,
         and the class-numbers as one-hot encoded arrays.
+
+        :param one_hot:
+            Format of the one-hot encoded labels, see encode_labels().
+            Use None to only get the integer class-numbers.
+
+        :param one_hot_dtype:
+            Data-type for the one-hot encoded labels.
         """
 
         return list(self.get_paths(test=True)), \
-               np.asarray(self.class_numbers_test), \
-               one_hot_encoded(class_numbers=self.class_numbers_test,
-                               num_classes=self.num_classes)
+               np.asarray(self.class_numbers_test, dtype=int), \
+               encode_labels(class_numbers=self.class_numbers_test,
+                             num_classes=self.num_classes,
+                             one_hot=one_hot, dtype=one_hot_dtype)
+
+    def _get_class_numbers(self, test=False):
+        """
+        Return the array of class-numbers for the test-set or training-set.
+        """
+
+        if test:
+            return np.asarray(self.class_numbers_test)
+        else:
+            return np.asarray(self.class_numbers)
+
+    def split(self, fraction=0.1, seed=None, test=False):
+        """
+        Split the files into two parts with the same proportion of each
+        class, e.g. to get a validation-set from the training-set.
+
+        The split is random but it can be reproduced with the seed.
+        Only the indices of the files are returned, so the files in each
+        part can be processed with get_paths(indices=...) without copying
+        the whole data-set.
+
+        :param fraction:
+            Fraction of the files of each class that is put in the
+            second part (rounded to the nearest integer).
+
+        :param seed:
+            Seed for the random split.
+
+        :param test:
+            Boolean. Split the test-set (True) or training-set (False).
+
+        :return:
+            Two sorted arrays of integers with the indices of the files
+            in the first part and the second part.
+        """
+
+        class_numbers = self._get_class_numbers(test=test)
+        num_files = len(class_numbers)
+
+        rng = np.random.RandomState(seed)
+
+        # Shuffle the files and then sort them by class-number with a
+        # stable sort, so the files of each class are grouped together
+        # in random order.
+        idx = rng.permutation(num_files)
+        idx = idx[np.argsort(class_numbers[idx], kind='mergesort')]
+
+        # Number of files for each class, and the position in idx
+        # where the files for each class begin.
+        counts = np.bincount(class_numbers, minlength=self.num_classes)
+        begins = np.cumsum(counts) - counts
+
+        # Rank of each file within its class.
+        sorted_classes = class_numbers[idx]
+        rank = np.arange(num_files) - begins[sorted_classes]
+
+        # Number of files of each class in the second part.
+        num_second = np.round(counts * fraction).astype(np.int64)
+
+        # Put the first files of each class in the second part.
+        is_second = rank < num_second[sorted_classes]
+
+        return np.sort(idx[~is_second]), np.sort(idx[is_second])
+
+    def shard(self, shard_index, num_shards, indices=None, shuffle=False,
+              seed=None, test=False):
+        """
+        Get the indices for one of several disjoint parts of the files,
+        e.g. so parallel workers can each process their own part.
+
+        All the workers must use the same arguments except shard_index,
+        so together the shards contain every file exactly once.
+
+        :param shard_index:
+            Index of the shard, between 0 and num_shards-1.
+
+        :param num_shards:
+            Number of shards.
+
+        :param indices:
+            Optional array with the indices of the files to divide into
+            shards, e.g. from split(). If None then use all the files.
+
+        :param shuffle:
+            Boolean whether to shuffle the files before dividing them,
+            so each shard gets a random selection of the files.
+            Otherwise each shard is a contiguous range of the files.
+
+        :param seed:
+            Seed for the shuffling. This must be the same for all workers.
+
+        :param test:
+            Boolean. Use the test-set (True) or training-set (False).
+
+        :return:
+            Array of integers with the indices of the files in the shard.
+        """
+
+        if not 0 <= shard_index < num_shards:
+            raise ValueError("shard_index must be between 0 and num_shards-1.")
+
+        if indices is None:
+            indices = np.arange(len(self._get_class_numbers(test=test)))
+        else:
+            indices = np.asarray(indices)
+
+        if shuffle:
+            indices = indices[np.random.RandomState(seed).permutation(len(indices))]
+
+        # Begin- and end-index for the shard, so the shards
+        # differ in size by at most one file.
+        num_files = len(indices)
+        begin = num_files * shard_index // num_shards
+        end = num_files * (shard_index + 1) // num_shards
+
+        shard = indices[begin:end]
+
+        if shuffle:
+            # Sort the indices so the files are processed in order.
+            shard = np.sort(shard)
+
+        return shard
 
 
 ########################################################################
 
 
-def load_cached(cache_path, in_dir):
+def load_cached(cache_path, in_dir, memory=False, refresh=False):
     """
     Wrapper-function for creating a DataSet-object, which will be
     loaded from a cache-file if it already exists, otherwise a new
@@ -277,6 +784,16 @@ def load_cached(cache_path, in_dir):
         Root-dir for the files in the data-set.
         This is an argument for the DataSet-init function.
 
+    :param memory:
+        Boolean whether to also keep the DataSet-object in memory, so
+        calling this function again in the same process returns the same
+        object without reloading the cache-file.
+
+    :param refresh:
+        Boolean whether to add new files to a DataSet-object that was
+        loaded from the cache-file, see DataSet.refresh(). The cache-file
+        is updated if any new files were found.
+
     :return:
         The DataSet-object.
     """
@@ -286,8 +803,24 @@ def load_cached(cache_path, in_dir):
     # If the object-instance for DataSet(in_dir=data_dir) already
     # exists in the cache-file then reload it, otherwise create
     # an object instance and save it to the cache-file for next time.
-    dataset = cache(cache_path=cache_path,
-                    fn=DataSet, in_dir=in_dir)
+    if memory:
+        dataset = cache_in_memory(cache_path=cache_path,
+                                  fn=DataSet, in_dir=in_dir)
+    else:
+        dataset = cache(cache_path=cache_path,
+                        fn=DataSet, in_dir=in_dir)
+
+    if refresh:
+        mtimes = dict(getattr(dataset, '_mtimes', {}))
+
+        num_new = dataset.refresh()
+
+        print("- Found {0} new files.".format(num_new))
+
+        # Save the DataSet-object if any directories have changed, even if
+        # no new files were found, so they are not rescanned next time.
+        if dataset._mtimes != mtimes:
+            update_cache(cache_path=cache_path, obj=dataset)
 
     return dataset
 
@@ -18,9 +18,17 @@
 
 import sys
 import os
+import json
+import hashlib
+import shutil
+import tempfile
+import threading
 import urllib.request
+import urllib.error
 import tarfile
 import zipfile
+import concurrent.futures
+from . import cache
 
 ########################################################################
 
@@ -31,7 +39,13 @@ def _print_download_progress(count, block_size, total_size):
     Used as a call-back function in maybe_download_and_extract().
     """
 
-    # Percentage completion.
+    # Percentage completion. The total size may be unknown.
+    if total_size is None or total_size <= 0:
+        msg = "\r- Download progress: {0:.1f} MB".format(count * block_size / 2 ** 20)
+        sys.stdout.write(msg)
+        sys.stdout.flush()
+        return
+
     pct_complete = float(count * block_size) / total_size
 
     # Status-message. Note the \r which means the line should overwrite itself.
@@ -43,13 +57,530 @@ def _print_download_progress(count, block_size, total_size):
 
 
 ########################################################################
+# Resumable downloads.
+#
+# The file is first downloaded to a temporary file with the extension
+# '.part', which is only renamed to the real filename when the download
+# is complete. If the download is interrupted then it is resumed from
+# the '.part'-file next time, using HTTP Range-requests if the server
+# supports them. Large files are downloaded as several ranges at the
+# same time, whose progress is saved in a file with the extension
+# '.part.json' so each range can also be resumed.
+
+# Number of bytes read from the connection at a time.
+_block_size = 2 ** 20
+
+# Size of each range when a file is downloaded as several ranges.
+_range_size = 16 * 2 ** 20
+
+# Files smaller than this are downloaded with a single connection.
+_min_parallel_size = 4 * _range_size
+
+# Default number of connections for downloading ranges in parallel.
+num_connections = 4
+
+
+def _get_file_info(url):
+    """
+    Return the size of the file at the url in bytes (or None if it is
+    unknown), and a boolean whether the server supports Range-requests.
+    """
+
+    request = urllib.request.Request(url, method='HEAD')
+
+    try:
+        with urllib.request.urlopen(request) as response:
+            size = response.headers.get('Content-Length')
+            accept_ranges = response.headers.get('Accept-Ranges', '')
+    except (OSError, ValueError):
+        # The server may not support HEAD-requests.
+        return None, False
+
+    size = int(size) if size is not None else None
+
+    return size, accept_ranges.strip().lower() == 'bytes'
+
+
+def _copy_response(response, file, progress=None, hasher=None):
+    """
+    Copy the data from the HTTP-response to the file-object.
+
+    :param progress:
+        Optional function called with the number of bytes for each block.
+
+    :param hasher:
+        Optional hash-object from hashlib that is updated with each block,
+        so the checksum is calculated while the data is being downloaded.
+    """
+
+    while True:
+        block = response.read(_block_size)
+        if not block:
+            break
+
+        file.write(block)
+
+        if hasher is not None:
+            hasher.update(block)
+
+        if progress is not None:
+            progress(len(block))
+
+
+def _hash_file(path, hasher, begin=0, end=None):
+    """
+    Update the hash-object with the bytes of the file between begin and end.
+    If end is None then read to the end of the file.
+    """
+
+    with open(path, mode='rb') as file:
+        file.seek(begin)
+
+        remaining = None if end is None else end - begin
+
+        while remaining is None or remaining > 0:
+            num_bytes = _block_size if remaining is None else min(_block_size, remaining)
+            block = file.read(num_bytes)
+            if not block:
+                break
+
+            hasher.update(block)
+
+            if remaining is not None:
+                remaining -= len(block)
+
+
+def file_checksum(path, hash_name='sha256'):
+    """
+    Calculate the checksum of a file.
+
+    :param path:
+        Path for the file.
+
+    :param hash_name:
+        Name of the hash-algorithm in hashlib, e.g. 'sha256' or 'md5'.
+
+    :return:
+        String with the hex-digest of the file.
+    """
+
+    hasher = hashlib.new(hash_name)
+    _hash_file(path, hasher)
+
+    return hasher.hexdigest()
+
+
+class _Progress:
+    def __init__(self, total_size, done=0):
+        """
+        Thread-safe counter for printing the download progress.
+        """
+
+        self.total_size = total_size
+        self.done = done
+        self._lock = threading.Lock()
+
+    def __call__(self, num_bytes):
+        with self._lock:
+            self.done += num_bytes
+            _print_download_progress(count=self.done, block_size=1,
+                                     total_size=self.total_size)
+
 
+def _download_single(url, part_path, size, accept_ranges, hasher=None):
+    """
+    Download the url to the '.part'-file with a single connection,
+    resuming from the end of the '.part'-file if possible.
+    """
+
+    state_path = part_path + '.json'
+
+    # Number of bytes that were already downloaded.
+    done = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+
+    if os.path.exists(state_path):
+        # The '.part'-file was created by _download_ranges() and has the
+        # full size, but the data may have gaps, so it cannot be resumed.
+        os.remove(state_path)
+        done = 0
+
+    if size is not None and done > size:
+        done = 0
+
+    if size is not None and done == size:
+        # The download was already complete.
+        if hasher is not None:
+            _hash_file(part_path, hasher)
+        return
+
+    request = urllib.request.Request(url)
+    if done > 0 and accept_ranges:
+        request.add_header('Range', 'bytes={0}-'.format(done))
+
+    try:
+        response = urllib.request.urlopen(request)
+    except urllib.error.HTTPError as e:
+        # The range is not valid for the file on the server,
+        # so download the whole file again.
+        if e.code != 416 or done == 0:
+            raise
+        done = 0
+        response = urllib.request.urlopen(url)
+
+    with response:
+        if done > 0 and response.status == 206:
+            # The server sends the rest of the file.
+            mode = 'ab'
+
+            # Hash the part that was already downloaded.
+            if hasher is not None:
+                _hash_file(part_path, hasher, end=done)
+        else:
+            # The server sends the whole file.
+            done = 0
+            mode = 'wb'
+
+        progress = _Progress(total_size=size, done=done)
+
+        with open(part_path, mode=mode) as file:
+            _copy_response(response, file, progress=progress, hasher=hasher)
+
+
+def _download_ranges(url, part_path, size, num_workers, hasher=None):
+    """
+    Download the url to the '.part'-file as several ranges in parallel.
+    The ranges that are complete are saved in a state-file, so only the
+    missing ranges are downloaded if this is resumed.
+
+    The hash-object is updated with the ranges in order while the later
+    ranges are still being downloaded, reading each range back from the
+    file right after it has been written, when it is still in the OS-cache.
+    """
+
+    state_path = part_path + '.json'
+
+    # List of the begin-index for each range.
+    begins = list(range(0, size, _range_size))
+
+    # Load the state from a previous download, if it was for the same file.
+    state = None
+    if os.path.exists(part_path) and os.path.exists(state_path):
+        try:
+            with open(state_path, mode='r') as file:
+                saved = json.load(file)
+            if saved.get('size') == size:
+                state = saved
+        except (OSError, ValueError):
+            pass
+
+    # A '.part'-file without a state-file is not trusted, because it
+    # may be from _download_single() or have gaps. The state-file is
+    # written before the '.part'-file is created with the full size,
+    # so a '.part'-file made here always has a state-file next to it,
+    # until the download is complete, see download().
+    if state is None:
+        state = {'size': size, 'done': []}
+
+        with open(state_path, mode='w') as file:
+            json.dump(state, file)
+
+        # Create the '.part'-file with the full size so all the ranges
+        # can be written into it.
+        with open(part_path, mode='wb') as file:
+            file.truncate(size)
 
-def maybe_download_and_extract(url, download_dir):
+    done = set(state['done'])
+    missing = [begin for begin in begins if begin not in done]
+
+    progress = _Progress(total_size=size,
+                         done=sum(min(_range_size, size - begin) for begin in done))
+
+    lock = threading.Lock()
+
+    # Lock and begin-index for the next range to be hashed.
+    hash_lock = threading.Lock()
+    hash_state = {'begin': 0}
+
+    def update_hash(blocking):
+        # Hash the completed ranges that follow the ones already hashed.
+        # If another thread is hashing and blocking is False then return,
+        # as that thread will also hash the new range or the final call will.
+        if hasher is None or not hash_lock.acquire(blocking):
+            return
+
+        try:
+            while hash_state['begin'] < size and hash_state['begin'] in done:
+                begin = hash_state['begin']
+                end = min(begin + _range_size, size)
+                _hash_file(part_path, hasher, begin=begin, end=end)
+                hash_state['begin'] = end
+        finally:
+            hash_lock.release()
+
+    def download_range(begin):
+        end = min(begin + _range_size, size) - 1
+
+        request = urllib.request.Request(url)
+        request.add_header('Range', 'bytes={0}-{1}'.format(begin, end))
+
+        with urllib.request.urlopen(request) as response:
+            if response.status != 206:
+                raise IOError("The server did not return the requested range.")
+
+            with open(part_path, mode='r+b') as file:
+                file.seek(begin)
+                _copy_response(response, file, progress=progress)
+
+        # Save that this range is complete.
+        with lock:
+            state['done'].append(begin)
+            done.add(begin)
+            with open(state_path, mode='w') as file:
+                json.dump(state, file)
+
+        update_hash(blocking=False)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=num_workers) as executor:
+        # Use list() to raise any exceptions from the threads.
+        list(executor.map(download_range, missing))
+
+    # Hash the ranges that were not hashed by the threads.
+    update_hash(blocking=True)
+
+
+def download(url, file_path, num_workers=None, checksum=None, hash_name='sha256'):
+    """
+    Download a file from the internet. The file is first saved with
+    the extension '.part' and it is only renamed to file_path when the
+    download is complete, so file_path never holds a partial file.
+    An interrupted download is resumed when this is called again.
+
+    If a checksum is given then it is calculated while the file is being
+    downloaded, and an IOError is raised if it does not match, in which
+    case the downloaded data is deleted.
+
+    :param url:
+        Internet URL for the file to download.
+
+    :param file_path:
+        Path where the file is saved.
+
+    :param num_workers:
+        Number of connections for downloading large files in parallel,
+        if the server supports Range-requests. If None then use
+        num_connections. Use 1 to always use a single connection.
+
+    :param checksum:
+        Optional string with the expected hex-digest of the file.
+
+    :param hash_name:
+        Name of the hash-algorithm in hashlib for the checksum,
+        e.g. 'sha256' or 'md5'.
+
+    :return:
+        The file_path.
+    """
+
+    if num_workers is None:
+        num_workers = num_connections
+
+    part_path = file_path + '.part'
+
+    # Hash-object for calculating the checksum while downloading.
+    hasher = hashlib.new(hash_name) if checksum is not None else None
+
+    size, accept_ranges = _get_file_info(url)
+
+    if num_workers > 1 and accept_ranges and size is not None and size >= _min_parallel_size:
+        _download_ranges(url, part_path, size=size, num_workers=num_workers, hasher=hasher)
+    else:
+        _download_single(url, part_path, size=size, accept_ranges=accept_ranges, hasher=hasher)
+
+    # Check the download is complete before renaming the file.
+    if size is not None and os.path.getsize(part_path) != size:
+        raise IOError("Download is incomplete: " + url)
+
+    # Check the checksum before renaming the file.
+    if hasher is not None and hasher.hexdigest() != checksum.lower():
+        os.remove(part_path)
+        if os.path.exists(part_path + '.json'):
+            os.remove(part_path + '.json')
+        msg = "Checksum of the downloaded file does not match: {0}\n" \
+              "Expected {1}: {2}\nActual {1}: {3}"
+        raise IOError(msg.format(url, hash_name, checksum.lower(), hasher.hexdigest()))
+
+    os.replace(part_path, file_path)
+
+    # Remove the state-file from _download_ranges() after the '.part'-file,
+    # so a '.part'-file with gaps is never left without its state-file.
+    if os.path.exists(part_path + '.json'):
+        os.remove(part_path + '.json')
+
+    return file_path
+
+
+########################################################################
+
+
+class _StreamReader:
+    def __init__(self, response, progress=None, hasher=None):
+        """
+        File-like wrapper for an HTTP-response which updates the progress
+        and hash-object with the data as it is being read, e.g. by tarfile.
+        """
+
+        self.response = response
+        self.progress = progress
+        self.hasher = hasher
+
+    def read(self, size=-1):
+        block = self.response.read(size)
+
+        if self.hasher is not None:
+            self.hasher.update(block)
+
+        if self.progress is not None and len(block) > 0:
+            self.progress(len(block))
+
+        return block
+
+
+def _move_tree(src_dir, dst_dir):
+    """
+    Move all the files and directories in src_dir into dst_dir,
+    merging them with the directories that already exist in dst_dir
+    and replacing the files that already exist.
+    """
+
+    for name in os.listdir(src_dir):
+        src_path = os.path.join(src_dir, name)
+        dst_path = os.path.join(dst_dir, name)
+
+        if os.path.isdir(src_path) and not os.path.islink(src_path) \
+                and os.path.isdir(dst_path):
+            # Merge with the existing directory.
+            _move_tree(src_dir=src_path, dst_dir=dst_path)
+        else:
+            os.replace(src_path, dst_path)
+
+
+def _download_and_extract_stream(url, download_dir, checksum=None, hash_name='sha256'):
+    """
+    Download a tar-ball and extract it while it is being downloaded,
+    by piping the HTTP-response through tarfile in stream-mode.
+    The tar-ball itself is not saved.
+
+    The files are extracted to a hidden temporary directory inside
+    download_dir, and only moved into download_dir when the whole
+    tar-ball has been downloaded. If a checksum is given then it is
+    calculated from the stream, and if it does not match then the
+    extracted files are deleted and an IOError is raised.
+    """
+
+    # Hash-object for calculating the checksum while downloading.
+    hasher = hashlib.new(hash_name) if checksum is not None else None
+
+    # Temporary directory on the same file-system as download_dir,
+    # so the extracted files can be renamed instead of copied.
+    tmp_dir = tempfile.mkdtemp(prefix='.extract-', dir=download_dir)
+
+    try:
+        with urllib.request.urlopen(url) as response:
+            size = response.headers.get('Content-Length')
+            size = int(size) if size is not None else None
+
+            reader = _StreamReader(response=response,
+                                   progress=_Progress(total_size=size),
+                                   hasher=hasher)
+
+            with tarfile.open(fileobj=reader, mode="r|gz") as archive:
+                archive.extractall(tmp_dir)
+
+            # Read the rest of the stream after the end of the tar-ball,
+            # so the checksum is calculated for the whole file.
+            while len(reader.read(_block_size)) > 0:
+                pass
+
+        if hasher is not None and hasher.hexdigest() != checksum.lower():
+            msg = "Checksum of the downloaded file does not match: {0}\n" \
+                  "Expected {1}: {2}\nActual {1}: {3}"
+            raise IOError(msg.format(url, hash_name, checksum.lower(), hasher.hexdigest()))
+
+        # The archive is verified so move the files into place.
+        _move_tree(src_dir=tmp_dir, dst_dir=download_dir)
+    finally:
+        # Delete the temporary directory and anything left in it.
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+def _marker_path(file_path):
+    """
+    Return the path for the marker-file that is written when the
+    archive in file_path has been completely extracted.
+    """
+
+    dir_name, filename = os.path.split(file_path)
+
+    return os.path.join(dir_name, '.' + filename + '.extracted')
+
+
+def _is_extracted(file_path, checksum=None):
+    """
+    Return boolean whether the archive in file_path has been completely
+    extracted, and if a checksum is given, that it was for the same checksum.
+    """
+
+    try:
+        with open(_marker_path(file_path), mode='r') as file:
+            marker = json.load(file)
+    except (OSError, ValueError):
+        return False
+
+    if checksum is not None and marker.get('checksum') != checksum.lower():
+        return False
+
+    return True
+
+
+def _write_marker(file_path, url, checksum=None):
+    """
+    Write the marker-file for the extracted archive in file_path.
+    It is written atomically, so the marker-file is never left
+    half-written, even if several processes extract the same archive.
+    """
+
+    marker = {'url': url,
+              'checksum': checksum.lower() if checksum is not None else None}
+
+    cache._atomic_write(_marker_path(file_path),
+                        lambda file: json.dump(marker, file), mode='w')
+
+
+def _extract(file_path, download_dir):
+    """
+    Extract the archive in file_path to download_dir.
+    """
+
+    if file_path.endswith(".zip"):
+        # Unpack the zip-file.
+        with zipfile.ZipFile(file=file_path, mode="r") as archive:
+            archive.extractall(download_dir)
+    elif file_path.endswith((".tar.gz", ".tgz")):
+        # Unpack the tar-ball.
+        with tarfile.open(name=file_path, mode="r:gz") as archive:
+            archive.extractall(download_dir)
+
+
+def maybe_download_and_extract(url, download_dir, checksum=None, hash_name='sha256',
+                               stream=False):
     """
     Download and extract the data if it doesn't already exist.
     Assumes the url is a tar-ball file.
 
+    A hidden marker-file is written in download_dir when the archive has
+    been completely extracted, so if the extraction is interrupted, it is
+    done again the next time this is called.
+
     :param url:
         Internet URL for the tar-file to download.
         Example: "https://www.cs.toronto.edu/~kriz/cifar-10-python.tar.gz"
@@ -58,6 +589,21 @@ def maybe_download_and_extract(url, download_dir):
         Directory where the downloaded file is saved.
         Example: "data/CIFAR-10/"
 
+    :param checksum:
+        Optional string with the expected hex-digest of the archive.
+        It is checked while downloading, or before extracting an archive
+        that was downloaded previously but not extracted.
+
+    :param hash_name:
+        Name of the hash-algorithm in hashlib for the checksum,
+        e.g. 'sha256' or 'md5'.
+
+    :param stream:
+        Boolean whether to extract a tar-ball while it is being downloaded,
+        without saving the tar-ball itself. This is faster and uses less
+        disk-space, but an interrupted download cannot be resumed.
+        Zip-files cannot be streamed and are always saved first.
+
     :return:
         Nothing.
     """
@@ -67,32 +613,88 @@ def maybe_download_and_extract(url, download_dir):
     filename = url.split('/')[-1]
     file_path = os.path.join(download_dir, filename)
 
-    # Check if the file already exists.
-    # If it exists then we assume it has also been extracted,
-    # otherwise we need to download and extract it now.
-    if not os.path.exists(file_path):
-        # Check if the download directory exists, otherwise create it.
-        if not os.path.exists(download_dir):
-            os.makedirs(download_dir)
+    # Check the marker-file for a complete extraction.
+    if _is_extracted(file_path, checksum=checksum):
+        print("Data has apparently already been downloaded and unpacked.")
+        return
 
-        # Download the file from the internet.
-        file_path, _ = urllib.request.urlretrieve(url=url,
-                                                  filename=file_path,
-                                                  reporthook=_print_download_progress)
+    # Check that an archive from a previous download has the right checksum,
+    # otherwise it is deleted and downloaded again.
+    if os.path.exists(file_path) and checksum is not None:
+        if file_checksum(file_path, hash_name=hash_name) != checksum.lower():
+            print("Checksum does not match for the existing file: " + file_path)
+            os.remove(file_path)
 
-        print()
-        print("Download finished. Extracting files.")
+    # Check if the download directory exists, otherwise create it.
+    # This may run in several threads, see maybe_download_and_extract_all().
+    os.makedirs(download_dir, exist_ok=True)
 
-        if file_path.endswith(".zip"):
-            # Unpack the zip-file.
-            zipfile.ZipFile(file=file_path, mode="r").extractall(download_dir)
-        elif file_path.endswith((".tar.gz", ".tgz")):
-            # Unpack the tar-ball.
-            tarfile.open(name=file_path, mode="r:gz").extractall(download_dir)
+    if stream and not os.path.exists(file_path) and file_path.endswith((".tar.gz", ".tgz")):
+        # Download and extract the tar-ball at the same time.
+        _download_and_extract_stream(url=url, download_dir=download_dir,
+                                     checksum=checksum, hash_name=hash_name)
 
-        print("Done.")
+        print()
+        print("Download and extraction finished.")
     else:
-        print("Data has apparently already been downloaded and unpacked.")
+        # The file is only created when the download is complete,
+        # and an interrupted download is resumed, see download().
+        if not os.path.exists(file_path):
+            # Download the file from the internet.
+            file_path = download(url=url, file_path=file_path,
+                                 checksum=checksum, hash_name=hash_name)
+
+            print()
+            print("Download finished. Extracting files.")
+        else:
+            print("Data has already been downloaded. Extracting files.")
+
+        _extract(file_path=file_path, download_dir=download_dir)
+
+    # Mark the extraction as complete.
+    _write_marker(file_path=file_path, url=url, checksum=checksum)
+
+    print("Done.")
+
+
+def maybe_download_and_extract_all(datasets, num_workers=4, stream=False):
+    """
+    Download and extract several data-sets concurrently, using
+    maybe_download_and_extract() for each of them.
+
+    Example:
+
+        datasets = [{'url': cifar10.data_url,
+                     'download_dir': cifar10.data_path,
+                     'checksum': cifar10.data_md5,
+                     'hash_name': 'md5'},
+                    {'url': "http://www.example.com/data.tar.gz",
+                     'download_dir': "data/example/"}]
+
+        maybe_download_and_extract_all(datasets, stream=True)
+
+    :param datasets:
+        List of dicts with the arguments for maybe_download_and_extract().
+
+    :param num_workers:
+        Max number of data-sets that are downloaded at the same time.
+
+    :param stream:
+        Default for the stream-argument of the data-sets that do not have it,
+        see maybe_download_and_extract().
+
+    :return:
+        Nothing.
+    """
+
+    def process(kwargs):
+        kwargs = dict(kwargs)
+        kwargs.setdefault('stream', stream)
+        maybe_download_and_extract(**kwargs)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=num_workers) as executor:
+        # Use list() to raise any exceptions from the threads.
+        list(executor.map(process, datasets))
 
 
 ########################################################################
@@ -0,0 +1,285 @@
+########################################################################
+#
+# Functions for decoding image-files into numpy arrays in parallel,
+# e.g. the files of a DataSet-object from dataset.py.
+#
+# Usage:
+# 1) Get the paths for the image-files, e.g. from DataSet.get_paths()
+# 2) Call load_images() to decode and resize all the images into a
+#    4-dim uint8 array with shape: [image_number, height, width, channel]
+#    or call iter_images() to process the images in chunks.
+#
+# The images are decoded by a pool of processes so it scales with the
+# number of CPU cores. The number of chunks being decoded at the same
+# time is limited, so memory-usage is bounded for any number of images.
+# If the output is memory-mapped to a file, the processes write their
+# images directly into the file instead of sending them back.
+#
+# This requires the PIL / Pillow package.
+#
+########################################################################
+
+import numpy as np
+import os
+import collections
+import concurrent.futures
+
+########################################################################
+
+# Image-modes in PIL for the supported number of channels.
+_modes = {1: 'L', 3: 'RGB', 4: 'RGBA'}
+
+########################################################################
+# Private functions that are run in the worker-processes.
+
+
+def _decode_image(path, size, num_channels):
+    """
+    Decode an image-file and resize it.
+
+    :param path:
+        Path for the image-file.
+
+    :param size:
+        Tuple with the output (height, width).
+
+    :param num_channels:
+        Number of channels in the output: 1, 3 or 4.
+
+    :return:
+        uint8 array with shape [height, width, num_channels].
+    """
+
+    from PIL import Image
+
+    height, width = size
+
+    with Image.open(path) as img:
+        img = img.convert(_modes[num_channels])
+
+        if img.size != (width, height):
+            img = img.resize((width, height), Image.BILINEAR)
+
+        image = np.asarray(img, dtype=np.uint8)
+
+    return image.reshape(height, width, num_channels)
+
+
+def _decode_chunk(paths, size, num_channels, mmap_path=None, begin=None):
+    """
+    Decode a chunk of image-files.
+
+    If mmap_path is None then the images are returned as an array,
+    otherwise they are written directly into the memory-mapped .npy-file
+    beginning at the given index, and None is returned.
+    """
+
+    images = np.empty(shape=(len(paths),) + tuple(size) + (num_channels,), dtype=np.uint8)
+
+    for i, path in enumerate(paths):
+        images[i] = _decode_image(path, size=size, num_channels=num_channels)
+
+    if mmap_path is None:
+        return images
+
+    out = np.load(mmap_path, mmap_mode='r+')
+    out[begin:begin + len(paths)] = images
+    out.flush()
+    del out
+
+    return None
+
+
+########################################################################
+# Public functions.
+
+
+def iter_images(paths, size, num_channels=3, chunk_size=64, ordered=True,
+                num_workers=None, max_pending=None, mmap_path=None):
+    """
+    Generator that decodes image-files in parallel and yields them in chunks.
+
+    :param paths:
+        List or iterator with the paths for the image-files,
+        e.g. from DataSet.get_paths().
+
+    :param size:
+        Tuple with the (height, width) the images are resized to.
+
+    :param num_channels:
+        Number of channels in the output: 1 (gray-scale), 3 (RGB) or 4 (RGBA).
+
+    :param chunk_size:
+        Number of images that are decoded together by a worker-process.
+
+    :param ordered:
+        Boolean whether the chunks are yielded in the same order as the
+        paths (True), or as soon as each chunk has been decoded (False)
+        which may be faster if the images have very different sizes.
+
+    :param num_workers:
+        Number of worker-processes. If None then use the number of CPU cores.
+        If 1 then the images are decoded in this process.
+
+    :param max_pending:
+        Maximum number of chunks that are being decoded or waiting to be
+        yielded. If None then use 2 * num_workers.
+
+    :param mmap_path:
+        Optional path for a .npy-file with the right shape for all the
+        images, which the worker-processes write into directly.
+        The yielded images are then None.
+
+    :return:
+        Generator that yields tuples with the begin-index of each chunk
+        and a uint8-array with the images in the chunk, which has the shape
+        [chunk_size, height, width, num_channels] (the last chunk may be
+        smaller).
+    """
+
+    if num_channels not in _modes:
+        raise ValueError("Invalid num_channels: " + str(num_channels))
+
+    paths = list(paths)
+
+    # Arguments for decoding each chunk.
+    chunks = [(paths[begin:begin + chunk_size], begin)
+              for begin in range(0, len(paths), chunk_size)]
+
+    if num_workers is None:
+        num_workers = os.cpu_count() or 1
+
+    if num_workers <= 1:
+        # Decode the images in this process.
+        for chunk_paths, begin in chunks:
+            images = _decode_chunk(chunk_paths, size=size, num_channels=num_channels,
+                                   mmap_path=mmap_path, begin=begin)
+            yield begin, images
+
+        return
+
+    if max_pending is None:
+        max_pending = 2 * num_workers
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=num_workers) as executor:
+        # Chunks that have been submitted to the worker-processes, in order.
+        pending = collections.deque()
+
+        chunks = iter(chunks)
+
+        def submit():
+            # Submit chunks until max_pending are being decoded.
+            # Returns False when all chunks have been submitted.
+            while len(pending) < max_pending:
+                try:
+                    chunk_paths, begin = next(chunks)
+                except StopIteration:
+                    return False
+
+                future = executor.submit(_decode_chunk, chunk_paths, size=size,
+                                         num_channels=num_channels,
+                                         mmap_path=mmap_path, begin=begin)
+                pending.append((begin, future))
+
+            return True
+
+        submit()
+
+        while len(pending) > 0:
+            if ordered:
+                # Wait for the oldest chunk.
+                begin, future = pending.popleft()
+            else:
+                # Wait for whichever chunk is decoded first.
+                futures = [future for _, future in pending]
+                concurrent.futures.wait(futures, return_when=concurrent.futures.FIRST_COMPLETED)
+                i = next(i for i, future in enumerate(futures) if future.done())
+                begin, future = pending[i]
+                del pending[i]
+
+            images = future.result()
+
+            # Submit a new chunk before yielding so the workers stay busy.
+            submit()
+
+            yield begin, images
+
+
+def load_images(paths, size, num_channels=3, out=None, mmap_path=None,
+                chunk_size=64, num_workers=None, max_pending=None):
+    """
+    Decode and resize image-files in parallel into a single uint8-array.
+
+    Example:
+
+        paths = list(dataset.get_paths())
+        images = load_images(paths, size=(224, 224))
+
+    :param paths:
+        List or iterator with the paths for the image-files,
+        e.g. from DataSet.get_paths().
+
+    :param size:
+        Tuple with the (height, width) the images are resized to.
+
+    :param num_channels:
+        Number of channels in the output: 1 (gray-scale), 3 (RGB) or 4 (RGBA).
+
+    :param out:
+        Optional pre-allocated uint8-array with the shape
+        [len(paths), height, width, num_channels].
+
+    :param mmap_path:
+        Optional path for a .npy-file that is created for the images,
+        so they do not have to fit in memory. The worker-processes write
+        directly into the file, which can later be opened again with
+        np.load(mmap_path, mmap_mode='r').
+
+    :param chunk_size:
+        Number of images that are decoded together by a worker-process.
+
+    :param num_workers:
+        Number of worker-processes, see iter_images().
+
+    :param max_pending:
+        Maximum number of chunks in progress, see iter_images().
+
+    :return:
+        uint8-array with shape [len(paths), height, width, num_channels],
+        which is memory-mapped if mmap_path was given.
+    """
+
+    paths = list(paths)
+
+    shape = (len(paths),) + tuple(size) + (num_channels,)
+
+    if mmap_path is not None:
+        if out is not None:
+            raise ValueError("Cannot use both out and mmap_path.")
+
+        # Create the .npy-file so the worker-processes can write into it.
+        out = np.lib.format.open_memmap(mmap_path, mode='w+', dtype=np.uint8, shape=shape)
+        out.flush()
+    elif out is None:
+        out = np.empty(shape=shape, dtype=np.uint8)
+    elif out.shape != shape or out.dtype != np.uint8:
+        raise ValueError("The out-array must be uint8 with shape: " + str(shape))
+
+    # The output is indexed by the begin-index of each chunk,
+    # so the chunks can be written in any order.
+    for begin, images in iter_images(paths, size=size, num_channels=num_channels,
+                                     chunk_size=chunk_size, ordered=False,
+                                     num_workers=num_workers, max_pending=max_pending,
+                                     mmap_path=mmap_path):
+        if images is not None:
+            out[begin:begin + len(images)] = images
+
+    if mmap_path is not None:
+        # Reopen the file so the images written by the workers are seen.
+        del out
+        out = np.load(mmap_path, mmap_mode='r+')
+
+    return out
+
+
+########################################################################
@@ -1,15 +1,302 @@
 import functools
+import threading
+import weakref
+import asyncio
 
-def lazy_property(function):
-    attribute = '_lazy_' + function.__name__
-    
-    @property
-    @functools.wraps(function)
-    def wrapper(self):
-        if not hasattr(self, attribute):
-            setattr(self, attribute, function(self))
-        return getattr(self, attribute)
-    return wrapper
+# Marker for a lazy property whose value has not been computed.
+_missing = object()
+
+
+class _LazyProperty:
+    def __init__(self, function, depends_on=()):
+        """
+        Descriptor for a property that is computed the first time it is
+        used and then saved in the instance, see lazy_property().
+        """
+
+        functools.update_wrapper(self, function)
+
+        self.function = function
+        self.name = function.__name__
+        self.attribute = '_lazy_' + function.__name__
+
+        # Names of the attributes this property is computed from.
+        self.depends_on = tuple(depends_on)
+
+        # Values for instances that cannot store the attribute themselves,
+        # e.g. classes with __slots__ that do not have a slot for it.
+        # They are keyed by the id of the instance, because instances that
+        # compare equal must still have separate values, together with a
+        # weak reference that removes the value when the instance is deleted.
+        self._values = {}
+        self._values_lock = threading.RLock()
+
+        # Lock for each instance whose value is being computed, along with
+        # the number of threads using the lock. The locks are removed again
+        # when no thread is using them, so they do not keep growing.
+        self._locks = {}
+        self._locks_lock = threading.Lock()
+
+    def __set_name__(self, owner, name):
+        self.name = name
+        self.attribute = '_lazy_' + name
+
+    def _get_value(self, instance):
+        value = getattr(instance, self.attribute, _missing)
+
+        if value is _missing:
+            entry = self._values.get(id(instance))
+
+            # The id may have been reused by a new instance.
+            if entry is not None and entry[0]() is instance:
+                value = entry[1]
+
+        return value
+
+    def _set_value(self, instance, value):
+        try:
+            setattr(instance, self.attribute, value)
+        except AttributeError:
+            # The class has __slots__ without a slot for the attribute.
+            key = id(instance)
+
+            def remove(ref):
+                # Called when the instance is deleted.
+                with self._values_lock:
+                    entry = self._values.get(key)
+                    if entry is not None and entry[0] is ref:
+                        del self._values[key]
+
+            try:
+                ref = weakref.ref(instance, remove)
+            except TypeError:
+                msg = "Class {0} must have '{1}' or '__weakref__' in its __slots__ " \
+                      "to use the lazy property '{2}'."
+                raise TypeError(msg.format(type(instance).__name__, self.attribute, self.name))
+
+            with self._values_lock:
+                self._values[key] = (ref, value)
+
+    def _del_value(self, instance):
+        try:
+            delattr(instance, self.attribute)
+        except AttributeError:
+            pass
+
+        with self._values_lock:
+            entry = self._values.get(id(instance))
+            if entry is not None and entry[0]() is instance:
+                del self._values[id(instance)]
+
+    def _compute(self, instance):
+        return self.function(instance)
+
+    def __get__(self, instance, owner=None):
+        if instance is None:
+            return self
+
+        # Fast path without locking when the value has been computed.
+        value = self._get_value(instance)
+        if value is not _missing:
+            return value
+
+        key = id(instance)
+
+        with self._locks_lock:
+            entry = self._locks.setdefault(key, [threading.RLock(), 0])
+            entry[1] += 1
+
+        try:
+            with entry[0]:
+                # Another thread may have computed the value while waiting.
+                value = self._get_value(instance)
+                if value is _missing:
+                    value = self._compute(instance)
+                    self._set_value(instance, value)
+        finally:
+            with self._locks_lock:
+                entry[1] -= 1
+                if entry[1] == 0:
+                    del self._locks[key]
+
+        return value
+
+    def __set__(self, instance, value):
+        self._set_value(instance, value)
+
+        # Note that invalidate_lazy() without names removes all values.
+        dependents = _dependents(type(instance), self.name)
+        if len(dependents) > 0:
+            invalidate_lazy(instance, *dependents)
+
+    def __delete__(self, instance):
+        invalidate_lazy(instance, self.name)
+
+
+class _AsyncLazyProperty(_LazyProperty):
+    def _compute(self, instance):
+        # Start the coroutine as a task which is saved as the value,
+        # so all callers await the same computation and its result.
+        task = asyncio.ensure_future(self.function(instance))
+
+        def done(task):
+            # Remove a failed task so the next access tries again.
+            if task.cancelled() or task.exception() is not None:
+                if self._get_value(instance) is task:
+                    self._del_value(instance)
+
+        task.add_done_callback(done)
+
+        return task
+
+
+def _lazy_properties(cls):
+    """
+    Return a dict with the lazy properties of a class and its base-classes.
+    """
+
+    properties = {}
+
+    for klass in reversed(cls.__mro__):
+        for name, value in vars(klass).items():
+            if isinstance(value, _LazyProperty):
+                properties[name] = value
+
+    return properties
+
+
+def _dependents(cls, name):
+    """
+    Return a list with the names of the lazy properties of the class
+    that depend on the attribute with the given name, either directly
+    or through other lazy properties.
+    """
+
+    properties = _lazy_properties(cls)
+
+    dependents = []
+    names = [name]
+
+    while len(names) > 0:
+        name = names.pop()
+
+        for prop_name, prop in properties.items():
+            if name in prop.depends_on and prop_name not in dependents:
+                dependents.append(prop_name)
+                names.append(prop_name)
+
+    return dependents
+
+
+def lazy_property(function=None, depends_on=()):
+    """
+    Decorator for a property that is computed the first time it is used,
+    and then saved in the instance as the attribute '_lazy_' + name.
+
+    The value is computed at most once for each instance, even if it is
+    used by several threads at the same time. The other threads wait for
+    the value instead of also computing it.
+
+    The saved value can be removed with 'del obj.name' or invalidate_lazy(),
+    so it is computed again the next time it is used. It can also be set
+    with 'obj.name = value'. If the property depends on other attributes
+    then it is also removed when they are invalidated.
+
+    Classes with __slots__ must either have a slot named '_lazy_' + name
+    or the slot '__weakref__'. In the latter case the values are kept
+    outside the instances, so a value that refers back to its instance
+    keeps the instance alive, which is avoided by using the first slot.
+
+    Example:
+
+        class Model:
+            @lazy_property
+            def graph(self):
+                ...
+
+            @lazy_property(depends_on=('graph',))
+            def optimizer(self):
+                ...
+
+    :param function:
+        Function that computes the value from the instance.
+
+    :param depends_on:
+        Names of the attributes the property is computed from.
+
+    :return:
+        Descriptor for the property.
+    """
+
+    if function is None:
+        return functools.partial(lazy_property, depends_on=depends_on)
+
+    return _LazyProperty(function, depends_on=depends_on)
+
+
+def async_lazy_property(function=None, depends_on=()):
+    """
+    Decorator for a lazy property that is computed by a coroutine.
+
+    Using the property returns an awaitable for the value. The coroutine
+    is run at most once for each instance, and all callers await the same
+    result. If the coroutine fails or is cancelled, it is run again the
+    next time the property is used.
+
+    The value belongs to the event-loop that was running the first time
+    the property was used.
+
+    Example:
+
+        class Model:
+            @async_lazy_property
+            async def weights(self):
+                ...
+
+        weights = await model.weights
+
+    :param function:
+        Coroutine-function that computes the value from the instance.
+
+    :param depends_on:
+        Names of the attributes the property is computed from.
+
+    :return:
+        Descriptor for the property.
+    """
+
+    if function is None:
+        return functools.partial(async_lazy_property, depends_on=depends_on)
+
+    return _AsyncLazyProperty(function, depends_on=depends_on)
+
+
+def invalidate_lazy(instance, *names):
+    """
+    Remove the saved values for lazy properties of an instance, so they
+    are computed again the next time they are used. The lazy properties
+    that depend on the given names are also removed.
+
+    :param instance:
+        Object with lazy properties.
+
+    :param names:
+        Names of lazy properties or other attributes that have changed.
+        If no names are given then all the lazy properties are removed.
+
+    :return:
+        Nothing.
+    """
+
+    properties = _lazy_properties(type(instance))
+
+    if len(names) == 0:
+        names = list(properties.keys())
+
+    for name in names:
+        for prop_name in [name] + _dependents(type(instance), name):
+            if prop_name in properties:
+                properties[prop_name]._del_value(instance)
 
 
 """
@@ -28,30 +315,130 @@ https://github.com/yaoli/GSN
 
 import numpy
 
-def scale_to_unit_interval(ndar, eps=1e-8):
+def _min_max(ndar, axis, chunk_size):
+    """
+    Returns the min and max of 'ndar' over the given axis, with the
+    reduced dimensions kept, reading at most chunk_size entries of the
+    first dimension at a time. If axis is None then numpy scalars are
+    returned.
+    """
+    reduce_first = axis is None or 0 in axis
+    mins, maxs = [], []
+    for begin in range(0, max(ndar.shape[0], 1), chunk_size):
+        chunk = ndar[begin:begin + chunk_size]
+        if axis is None:
+            mins.append(chunk.min())
+            maxs.append(chunk.max())
+        else:
+            mins.append(chunk.min(axis=axis, keepdims=True))
+            maxs.append(chunk.max(axis=axis, keepdims=True))
+    if len(mins) == 1:
+        return mins[0], maxs[0]
+    if reduce_first:
+        # the min and max of the chunks are reduced further
+        if axis is None:
+            return min(mins), max(maxs)
+        return numpy.minimum.reduce(mins), numpy.maximum.reduce(maxs)
+    # each chunk has the min and max for its own entries
+    return numpy.concatenate(mins), numpy.concatenate(maxs)
+
+def scale_to_unit_interval(ndar, eps=1e-8, axis=None, out=None, copy=True,
+                           chunk_size=None):
     """
     Scales all values in the ndarray 'ndar' to be between 0 and 1.
 
+    The values can also be scaled separately along an axis, e.g. axis=1
+    scales each row of a 2D array to be between 0 and 1. The result can
+    be written to an existing array with 'out', or to 'ndar' itself with
+    copy=False, so no other array of the same size is allocated.
+
+    Arrays that are bigger than the memory, e.g. a numpy.memmap, are
+    processed in chunks along the first dimension.
+
     Parameters
     ----------
     ndar : numpy.ndarray
         The input array to scale values.
     eps : float
         Small value to avoid divide-by-zero when scaling.
+    axis : None or int or tuple of ints
+        The axis or axes over which the min and max are computed.
+        If None then the whole array is scaled using the same min and max.
+    out : numpy.ndarray, optional
+        Array with the same shape as 'ndar' and a floating point dtype
+        to store the result in.
+    copy : bool
+        If False then 'ndar' is scaled in-place, which requires it to
+        have a floating point dtype. Ignored if 'out' is given.
+    chunk_size : int, optional
+        The number of entries along the first dimension that are processed
+        at a time. If None then the whole array is processed at once, unless
+        it is a numpy.memmap which is processed in chunks of about 64 MB.
 
     Returns
     -------
     numpy.ndarray
         The input array scaled to be between 0 and 1.
     """
-    ndar = ndar.copy()
-    ndar -= ndar.min()
-    ndar *= 1.0 / (ndar.max() + eps)
-    return ndar
+    if out is None:
+        if copy:
+            dt = ndar.dtype if ndar.dtype.kind == 'f' else float
+            out = numpy.empty(ndar.shape, dtype=dt)
+        else:
+            if ndar.dtype.kind != 'f':
+                raise TypeError("copy=False requires 'ndar' to have a "
+                                "floating point dtype, not " + str(ndar.dtype))
+            out = ndar
+    else:
+        assert out.shape == ndar.shape
+        if out.dtype.kind != 'f':
+            raise TypeError("'out' must have a floating point dtype, not " +
+                            str(out.dtype))
+    result = out
+
+    if ndar.ndim == 0:
+        # a scalar array cannot be split into chunks
+        ndar = ndar.reshape(1)
+        out = out.reshape(1)
+
+    if axis is not None:
+        # normalise the axes to a tuple of non-negative ints
+        if not isinstance(axis, tuple):
+            axis = (axis,)
+        axis = tuple(a % ndar.ndim for a in axis)
+
+    if chunk_size is None:
+        if isinstance(ndar, numpy.memmap) or isinstance(out, numpy.memmap):
+            row_bytes = max(ndar.nbytes // max(ndar.shape[0], 1), 1)
+            chunk_size = max(2 ** 26 // row_bytes, 1)
+        else:
+            chunk_size = max(ndar.shape[0], 1)
+
+    mins, maxs = _min_max(ndar, axis, chunk_size)
+    scales = 1.0 / ((maxs - mins) + eps)
+
+    # the min and max are for all chunks if the first dimension is reduced
+    reduce_first = axis is None or 0 in axis
+
+    for begin in range(0, ndar.shape[0], chunk_size):
+        end = begin + chunk_size
+        if reduce_first:
+            chunk_mins, chunk_scales = mins, scales
+        else:
+            chunk_mins, chunk_scales = mins[begin:end], scales[begin:end]
+        chunk_out = out[begin:end]
+        numpy.subtract(ndar[begin:end], chunk_mins, out=chunk_out,
+                       casting='unsafe')
+        numpy.multiply(chunk_out, chunk_scales, out=chunk_out,
+                       casting='unsafe')
+
+    if isinstance(result, numpy.memmap):
+        result.flush()
+    return result
 
 def tile_raster_images(X, img_shape, tile_shape, tile_spacing=(0, 0),
                        scale_rows_to_unit_interval=True,
-                       output_pixel_vals=True):
+                       output_pixel_vals=True, out=None):
     """   
     Transform an array with one flattened image per row, into an array in
     which images are reshaped and layed out like tiles on a floor.
@@ -60,6 +447,9 @@ def tile_raster_images(X, img_shape, tile_shape, tile_spacing=(0, 0),
     and also columns of matrices for transforming those rows
     (such as the first layer of a neural net).
 
+    All the images are scaled and copied into the output at once, using
+    a strided view of the output with one block for each tile.
+
     Parameters
     ----------
     X : 2D ndarray or a tuple of 4 channels, elements of which can be 2D ndarrays or None
@@ -74,6 +464,10 @@ def tile_raster_images(X, img_shape, tile_shape, tile_spacing=(0, 0),
         If the values need to be scaled before being plotted to [0,1] or not.
     output_pixel_vals : bool
         If output should be pixel values (i.e. int8 values) or floats.
+    out : numpy.ndarray, optional
+        Array to store the output in, e.g. to reuse the same buffer for
+        several mosaics. It must have the shape of the output, and the
+        dtype uint8 if output_pixel_vals is True.
 
     Returns
     -------
@@ -99,12 +493,17 @@ def tile_raster_images(X, img_shape, tile_shape, tile_spacing=(0, 0),
     if isinstance(X, tuple):
         assert len(X) == 4
         # Create an output numpy ndarray to store the image
-        if output_pixel_vals:
+        if out is not None:
+            assert out.shape == (out_shape[0], out_shape[1], 4)
+            out_array = out
+        elif output_pixel_vals:
             out_array = numpy.zeros((out_shape[0], out_shape[1], 4),
                                     dtype='uint8')
         else:
+            # use the dtype of the first channel that is not None
+            dt = next((x.dtype for x in X if x is not None), float)
             out_array = numpy.zeros((out_shape[0], out_shape[1], 4),
-                                    dtype=X.dtype)
+                                    dtype=dt)
 
         #colors default to 0, alpha defaults to 1 (opaque)
         if output_pixel_vals:
@@ -112,53 +511,64 @@ def tile_raster_images(X, img_shape, tile_shape, tile_spacing=(0, 0),
         else:
             channel_defaults = [0., 0., 0., 1.]
 
-        for i in xrange(4):
+        for i in range(4):
             if X[i] is None:
-                # if channel is None, fill it with zeros of the correct
-                # dtype
-                dt = out_array.dtype
-                if output_pixel_vals:
-                    dt = 'uint8'
-                out_array[:, :, i] = numpy.zeros(out_shape,
-                        dtype=dt) + channel_defaults[i]
+                # if channel is None, fill it with the default value
+                out_array[:, :, i] = channel_defaults[i]
             else:
                 # use a recurrent call to run the channel and store it
-                # in the output
-                out_array[:, :, i] = tile_raster_images(
+                # directly in the output
+                tile_raster_images(
                     X[i], img_shape, tile_shape, tile_spacing,
-                    scale_rows_to_unit_interval, output_pixel_vals)
+                    scale_rows_to_unit_interval, output_pixel_vals,
+                    out=out_array[:, :, i])
         return out_array
 
     else:
         # if we are dealing with only one channel
         H, W = img_shape
         Hs, Ws = tile_spacing
+        tile_rows, tile_cols = tile_shape
 
         # generate a matrix to store the output
-        dt = X.dtype
+        if out is not None:
+            assert out.shape == tuple(out_shape)
+            assert not output_pixel_vals or out.dtype == numpy.uint8
+            out_array = out
+            out_array[...] = 0
+        else:
+            dt = X.dtype
+            if output_pixel_vals:
+                dt = 'uint8'
+            out_array = numpy.zeros(out_shape, dtype=dt)
+
+        # only the images that fit in the tiles are used
+        X = X[:tile_rows * tile_cols]
+        num_images = X.shape[0]
+
+        if scale_rows_to_unit_interval:
+            # scale the values of each image to be between 0 and 1
+            X = scale_to_unit_interval(X, axis=1)
+
         if output_pixel_vals:
-            dt = 'uint8'
-        out_array = numpy.zeros(out_shape, dtype=dt)
-
-        for tile_row in xrange(tile_shape[0]):
-            for tile_col in xrange(tile_shape[1]):
-                if tile_row * tile_shape[1] + tile_col < X.shape[0]:
-                    this_x = X[tile_row * tile_shape[1] + tile_col]
-                    if scale_rows_to_unit_interval:
-                        # if we should scale values to be between 0 and 1
-                        # do this by calling the `scale_to_unit_interval`
-                        # function
-                        this_img = scale_to_unit_interval(
-                            this_x.reshape(img_shape))
-                    else:
-                        this_img = this_x.reshape(img_shape)
-                    # add the slice to the corresponding position in the
-                    # output array
-                    c = 1
-                    if output_pixel_vals:
-                        c = 255
-                    out_array[
-                        tile_row * (H + Hs): tile_row * (H + Hs) + H,
-                        tile_col * (W + Ws): tile_col * (W + Ws) + W
-                        ] = this_img * c
+            X = X * 255
+
+        images = X.reshape(num_images, H, W)
+
+        # strided view of the output with the shape
+        # (tile_rows, tile_cols, H, W) where [r, c] is the image in
+        # the tile at row r and column c, skipping the spacing
+        s0, s1 = out_array.strides
+        tiles = numpy.lib.stride_tricks.as_strided(
+            out_array, shape=(tile_rows, tile_cols, H, W),
+            strides=(s0 * (H + Hs), s1 * (W + Ws), s0, s1))
+
+        # copy the full rows of tiles and then the last partial row,
+        # casting to the output dtype the same as the assignment of
+        # each tile did
+        full_rows, rest = divmod(num_images, tile_cols)
+        tiles[:full_rows] = images[:full_rows * tile_cols].reshape(
+            full_rows, tile_cols, H, W)
+        if rest > 0:
+            tiles[full_rows, :rest] = images[full_rows * tile_cols:]
         return out_array